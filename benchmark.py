@@ -0,0 +1,284 @@
+"""离线基准测试：本地模拟 metatube / gyutto / 图片服务器，生成假的媒体库，测三个脚本的端到端速度
+
+    python benchmark.py --scraper getchu --folders 200 --latency 0.05 --error-rate 0.01
+    python benchmark.py --scraper gyutto --pipeline
+    python benchmark.py --check-parser [保存的gyutto页面目录，默认 tests/fixtures/gyutto]
+
+结果输出每秒处理资料夹数、每个资料夹的请求数，各阶段 p50/p99 耗时见 metrics 的汇总表。
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import config
+import metrics
+
+_GYUTTO_PAGE = """<html><head><title>item{item_id}</title></head><body><div id="wrap">
+<div class="parts_Mds01 clearfix"><h1>{title}</h1></div>
+<div class="unit_DojinMainPh"><a class="highslide" href="#"><img src="/data/item_img/{prefix}/{item_id}/{item_id}.jpg"></a></div>
+<div class="unit_SamplePhSmall"><ul>{samples}</ul></div>
+<div class="unit_DetailBasicInfo"><dl class="BasicInfo clearfix">
+<dt>サークル</dt><dd><a href="/circle/1">Circle {item_id}</a></dd>
+<dt>ジャンル</dt><dd><a>tag1</a> <a>tag2</a> <a>tag3</a></dd>
+<dt>配信開始日</dt><dd>2024年01月02日</dd></dl></div>
+<div class="unit_DetailSummary clearfix"><div class="ItemLead">Lead {item_id}</div><p>Body</p></div>
+</div></body></html>"""
+
+_SAMPLE = '<li><a class="highslide" href="#"><img src="/data/item_img/{prefix}/{item_id}/{item_id}_{n}.jpg"></a></li>'
+
+
+class StandIn:
+    """本地 HTTP 替身：metatube 的三个接口、gyutto 商品页和图片
+
+    latency 为每个请求的平均延迟秒数，error_rate 为随机返回 503 的比例，
+    商品 ID 以 99 结尾的当作下架商品。
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, image_size=200 * 1024, previews=3):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.image = os.urandom(image_size)
+        self.previews = previews
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, kind):
+        with self._lock:
+            self.counts[kind] += 1
+
+    def _metadata(self, provider, item_id):
+        images = f"{self.url}/img/{provider}/{item_id}"
+        return {
+            "id": item_id,
+            "provider": provider,
+            "number": f"{provider.upper()}-{item_id}",
+            "title": f"Title {item_id}",
+            "label": f"Label {item_id}",
+            "summary": f"Summary {item_id}",
+            "genres": ["genre1", "genre2"],
+            "release_date": "2024-01-02T00:00:00Z",
+            "cover_url": f"{images}/cover.jpg",
+            "preview_images": [f"{images}/{n}.jpg" for n in range(self.previews)],
+        }
+
+    def _route(self, path, query):
+        """返回 (请求类型, 状态码, Content-Type, 内容)"""
+        match = re.fullmatch(r"/v1/movies/search", path)
+        if match:
+            q = query.get("q", [""])[0]
+            item_id = "".join(re.findall(r"\d", q)) or "0"
+            if item_id.endswith("99"):
+                return "search", 200, "application/json", json.dumps({"data": []}).encode()
+            data = [{"id": item_id, "provider": "Stub"}]
+            return "search", 200, "application/json", json.dumps({"data": data}).encode()
+        match = re.fullmatch(r"/v1/movies/([^/]+)/([^/]+)", path)
+        if match:
+            provider, item_id = match.groups()
+            if item_id.endswith("99"):
+                return "metadata", 404, "application/json", json.dumps({"data": {}}).encode()
+            body = json.dumps({"data": self._metadata(provider, item_id)}).encode()
+            return "metadata", 200, "application/json", body
+        match = re.fullmatch(r"/i/item(\d+)", path)
+        if match:
+            item_id = match.group(1)
+            title = "エラーが発生しました。" if item_id.endswith("99") else f"Gyutto {item_id}"
+            samples = "".join(_SAMPLE.format(prefix=item_id[:-2], item_id=item_id, n=430 + n)
+                              for n in range(self.previews))
+            page = _GYUTTO_PAGE.format(item_id=item_id, prefix=item_id[:-2], title=title, samples=samples)
+            return "page", 200, "text/html; charset=utf-8", page.encode("utf-8")
+        if path.startswith("/img/"):
+            return "image", 200, "image/jpeg", self.image
+        # 下架商品的图片只有老的几种命名存在，多猜的候选都是 404
+        match = re.fullmatch(r"/data/item_img/\d+/\d+/\d+(top|_\d+)?\.jpg", path)
+        if match:
+            suffix = match.group(1) or ""
+            existing = {"", "top"} | {f"_{n}" for n in range(2977, 2980)} | {f"_{430 + n}" for n in range(self.previews)}
+            if suffix in existing:
+                return "image", 200, "image/jpeg", self.image
+        return "other", 404, "text/plain", b"not found"
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # 头和内容分开写，不关的话每个请求多 40ms
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self.do_GET(head=True)
+
+            def do_GET(self, head=False):
+                parts = urlsplit(self.path)
+                kind, status, content_type, body = stand_in._route(parts.path, parse_qs(parts.query))
+                stand_in._count("probe" if head else kind)
+                if stand_in.latency:
+                    time.sleep(random.uniform(0.5, 1.5) * stand_in.latency)
+                if random.random() < stand_in.error_rate:
+                    status, content_type, body = 503, "text/plain", b"unavailable"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+
+        return Handler
+
+
+def make_library(root, count, scraper, discs=1):
+    """生成 count 个资料夹，每个带 discs 个嵌套的视频目录"""
+    names = {
+        "getchu": ["item{id}", "[GETCHU-{id}]"],
+        "gyutto": ["item{id}", "[GYUTTO-{id}]"],
+        "zidong": ["STUB-{id}"],
+        "mixed": ["item{id}", "[GETCHU-{id}]", "[GYUTTO-{id}]", "STUB-{id}"],
+    }[scraper]
+    os.makedirs(root, exist_ok=True)
+    for n in range(count):
+        item_id = str(100000 + n)
+        folder = os.path.join(root, names[n % len(names)].format(id=item_id))
+        for disc in range(discs):
+            video_dir = os.path.join(folder, f"disc{disc + 1}")
+            os.makedirs(video_dir, exist_ok=True)
+            open(os.path.join(video_dir, "video.mp4"), "wb").close()
+    return root
+
+
+def run_scraper(scraper, library, stand_in):
+    """把脚本指向本地替身后跑一遍"""
+    import httpclient
+    if scraper == "getchu":
+        import getchu
+        getchu.getchu_image_url = stand_in.url
+        httpclient.register_host(stand_in.url, "metatube")
+        getchu.process_folders(library, f"{stand_in.url}/v1/movies/Getchu")
+    elif scraper == "gyutto":
+        import gyutto
+        gyutto.GYUTTO_URL = stand_in.url
+        gyutto.GYUTTO_IMAGE_URL = stand_in.url
+        gyutto.process_folders(library)
+    elif scraper == "mixed":
+        import getchu
+        import gyutto
+        import scrape
+        getchu.getchu_image_url = stand_in.url
+        gyutto.GYUTTO_URL = stand_in.url
+        gyutto.GYUTTO_IMAGE_URL = stand_in.url
+        httpclient.register_host(stand_in.url, "metatube")
+        scrape.process_folders(library, stand_in.url)
+    else:
+        import zidong
+        httpclient.register_host(stand_in.url, "metatube")
+        zidong.process_folders(library, stand_in.url)
+
+
+def benchmark(scraper, folders, latency, error_rate, use_pipeline, discs=1, keep=False):
+    workdir = tempfile.mkdtemp(prefix="scrape-bench-")
+    # 缓存和状态记录放到临时目录，不碰正式的；限速放开，测的是脚本本身
+    config.CACHE_PATH = os.path.join(workdir, "cache.sqlite3")
+    config.JOURNAL_PATH = os.path.join(workdir, "journal.jsonl")
+    config.ID_INDEX_PATH = os.path.join(workdir, "ids.sqlite3")
+    config.VALIDATORS_PATH = os.path.join(workdir, "validators.sqlite3")
+    config.IMAGE_RECORD_PATH = os.path.join(workdir, "images.sqlite3")
+    config.METRICS_PATH = os.path.join(workdir, "metrics.jsonl")
+    # 只跑生成的资料库，单进程，不做计划、断点续跑和图片仓库，和本地设置无关
+    config.MEDIA_ROOTS = []
+    config.PROCESS_WORKERS = 1
+    config.PLAN_MODE = None
+    config.JOB_QUEUE_PATH = None
+    config.IMAGE_STORE_PATH = None
+    config.PIPELINE_MODE = use_pipeline
+    config.RATE_LIMITS = {"default": (10000, 10000)}
+    config.REQUEUE_DELAY = 0
+    library = make_library(os.path.join(workdir, "library"), folders, scraper, discs)
+
+    # 各阶段 p50/p99 由 metrics 在运行结束时打印
+    config.METRICS_SUMMARY = True
+    metrics.reset()
+
+    stand_in = StandIn(latency, error_rate).start()
+    try:
+        start = time.perf_counter()
+        run_scraper(scraper, library, stand_in)
+        elapsed = time.perf_counter() - start
+    finally:
+        stand_in.stop()
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    requests_total = sum(stand_in.counts.values())
+    print()
+    print(f"scraper={scraper} folders={folders} latency={latency}s error_rate={error_rate} "
+          f"pipeline={use_pipeline}")
+    print(f"total {elapsed:.2f}s, {folders / elapsed:.1f} folders/s, "
+          f"{requests_total / folders:.2f} requests/folder ({dict(stand_in.counts)})")
+    if keep:
+        print(f"work directory kept at {workdir}")
+
+
+_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "fixtures", "gyutto")
+
+
+def check_parser(directory):
+    """用保存的 gyutto 商品页对比 parse_item_page 和旧的 parse_item_page_legacy，返回不一致的数量"""
+    import gyutto
+    mismatches = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith((".html", ".htm")):
+            continue
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            html = f.read()
+        item_id = "".join(re.findall(r"\d", name)) or "0"
+        fast = gyutto.parse_item_page(html, item_id)
+        legacy = gyutto.parse_item_page_legacy(html, item_id)
+        if fast != legacy:
+            mismatches += 1
+            print(f"MISMATCH {name}:\n  fast:   {fast}\n  legacy: {legacy}")
+        else:
+            print(f"ok {name}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scraper", choices=["getchu", "gyutto", "zidong", "mixed"], default="getchu")
+    parser.add_argument("--folders", type=int, default=100)
+    parser.add_argument("--discs", type=int, default=1, help="每个资料夹的视频目录数")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟的平均响应延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 503 的比例")
+    parser.add_argument("--pipeline", action="store_true", help="使用流水线模式")
+    parser.add_argument("--keep", action="store_true", help="保留生成的媒体库和缓存")
+    parser.add_argument("--check-parser", metavar="DIR", nargs="?", const=_FIXTURES,
+                        help="对比两个 gyutto 解析器在保存页面上的结果，默认用 tests/fixtures/gyutto")
+    args = parser.parse_args()
+
+    if args.check_parser:
+        raise SystemExit(1 if check_parser(args.check_parser) else 0)
+    benchmark(args.scraper, args.folders, args.latency, args.error_rate, args.pipeline, args.discs, args.keep)
+
+
+if __name__ == "__main__":
+    main()
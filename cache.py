@@ -0,0 +1,122 @@
+import json
+import sqlite3
+import threading
+import time
+
+import config
+import metrics
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    provider TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    negative INTEGER NOT NULL,
+    created REAL NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (provider, key)
+)
+"""
+
+
+class MetadataCache:
+    """按 (provider, 商品ID) 保存元数据的 SQLite 缓存
+
+    正常结果和下架/查不到的结果（negative）使用不同的过期时间，
+    超过 max_entries 时删除最旧的记录。
+    """
+
+    def __init__(self, path, ttl, negative_ttl, max_entries):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def get(self, provider, key):
+        """返回 (是否命中, 值)，negative 记录命中时值为 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, negative, expires FROM entries WHERE provider = ? AND key = ?",
+                (provider, str(key)),
+            ).fetchone()
+        if row is None or row[2] < time.time():
+            metrics.incr(f"cache miss {provider}")
+            return False, None
+        metrics.incr(f"cache hit {provider}")
+        if row[1]:
+            return True, None
+        return True, json.loads(row[0])
+
+    def put(self, provider, key, value):
+        """保存结果，value 为空（{}、None、[]）时记为 negative"""
+        now = time.time()
+        negative = not value
+        expires = now + (self.negative_ttl if negative else self.ttl)
+        payload = None if negative else json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (provider, str(key), payload, int(negative), now, expires),
+            )
+            self._conn.commit()
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._evict()
+
+    def delete(self, provider, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE provider = ? AND key = ?", (provider, str(key)))
+            self._conn.commit()
+
+    def _evict(self):
+        self._conn.execute("DELETE FROM entries WHERE expires < ?", (time.time(),))
+        count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries ORDER BY created LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self._conn.close()
+
+
+class _NullCache:
+    """关闭缓存时使用，什么都不存"""
+
+    def get(self, provider, key):
+        return False, None
+
+    def put(self, provider, key, value):
+        pass
+
+    def delete(self, provider, key):
+        pass
+
+    def close(self):
+        pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """全局缓存实例，第一次调用时按 config 创建"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if config.CACHE_ENABLED:
+                _cache = MetadataCache(config.CACHE_PATH, config.CACHE_TTL,
+                                       config.CACHE_NEGATIVE_TTL, config.CACHE_MAX_ENTRIES)
+            else:
+                _cache = _NullCache()
+    return _cache
@@ -0,0 +1,144 @@
+# 三个脚本共用的设置，按需修改
+
+# 图片下载线程池大小
+DOWNLOAD_WORKERS = 8
+# 同一主机同时下载的上限，太高容易被封
+PER_HOST_LIMIT = 4
+
+# HTTP 连接池设置，metatube、图片 CDN 和其他站点（gyutto.com 页面等）分开调
+# timeout 为 (连接超时, 读取超时) 秒，retries 为连接错误和 5xx 的重试次数
+HTTP_PROFILES = {
+    "metatube": {"pool_connections": 2, "pool_maxsize": 16, "timeout": (5, 60), "retries": 2, "backoff": 0.5},
+    "image": {"pool_connections": 8, "pool_maxsize": 16, "timeout": (5, 30), "retries": 3, "backoff": 0.5},
+    "default": {"pool_connections": 4, "pool_maxsize": 8, "timeout": (5, 30), "retries": 2, "backoff": 1.0},
+}
+# 这些主机（或以其结尾的主机）走 image 连接池
+IMAGE_HOSTS = ("image.gyutto.com", "dl.getchu.com", ".contents.fc2.com")
+
+# 元数据本地缓存（SQLite），重跑时直接从磁盘读，不再请求 metatube / gyutto
+CACHE_ENABLED = True
+CACHE_PATH = "scrape_cache.sqlite3"
+# 正常结果保存 30 天，下架/查不到的结果保存 1 天
+CACHE_TTL = 30 * 24 * 3600
+CACHE_NEGATIVE_TTL = 24 * 3600
+# 超过这个条数就删掉最旧的
+CACHE_MAX_ENTRIES = 100000
+
+# 下载过的图片的 ETag / Last-Modified，重新验证和断点续传用，单独存一个文件，不占元数据缓存。
+# None 则只记在内存里
+VALIDATORS_PATH = "scrape_validators.sqlite3"
+
+# zidong 的本地番号索引：资料夹名/番号 -> (provider, 商品ID)，查到过的资料夹重跑时不再调搜索接口
+# 可以用 python idindex.py import 批量导入，None 关闭
+ID_INDEX_PATH = "scrape_ids.sqlite3"
+
+# 增量模式：记录已经刮削完成的资料夹，下次运行时内容没变就直接跳过
+# 中途中断的话重跑会从没完成的资料夹继续。状态记录只在增量模式或监视模式（WATCH_MODE）下写
+INCREMENTAL = False
+JOURNAL_PATH = "scrape_journal.jsonl"
+
+# scrape.py 一次刮混合媒体库时，纯 itemXXXX 的资料夹交给哪个来源（"Getchu" 或 "Gyutto"）
+# [GETCHU-XXXX] / [GYUTTO-XXXX] 不受影响，其他名字都走 metatube 搜索
+ITEM_PROVIDER = "Getchu"
+
+# 多个媒体库根目录（比如不同的磁盘），和脚本里的 base_directory 一起刮
+MEDIA_ROOTS = []
+# 工作进程数，1 为单进程，None 为 CPU 核数。多进程时资料夹分片交给各进程，
+# 每个进程自己的连接池，限速所有进程加起来算；网络都走缓存后解析网页和写 NFO 就能用上多个核
+PROCESS_WORKERS = 1
+# 每个分片的资料夹数，进程做完一片再领下一片
+SHARD_SIZE = 20
+
+# NFO 总是先写临时文件再改名，内容和已有的一样就不写（不会触发媒体服务器重新扫描）
+# 每个 NFO 改名前都会 fsync；批量模式下所在目录跨资料夹攒着，攒够 N 个目录或运行结束时
+# 每个目录同步一次；0 为每个 NFO 改名后马上同步目录
+NFO_BATCH_SIZE = 200
+
+# 计划模式："plan" 只扫描和查元数据（结果进缓存），把要下载的图片、要写的 NFO、要改的名字
+# （包括重名冲突和超过 220 字节、改名时会被截断的名字）写到 PLAN_PATH，不动任何文件；
+# 看过之后改成 "execute" 按计划执行，不再查元数据。None 为正常刮削
+PLAN_MODE = None
+PLAN_PATH = "scrape_plan.json"
+
+# 断点续跑：每个资料夹的进度（元数据、图片、NFO、改名做到哪一步）存在这个 SQLite 文件里，
+# 崩溃、Ctrl-C、断电后重跑从停下的那一步接着做；资料夹每次从队列取 QUEUE_BATCH_SIZE 个，
+# 几万个资料夹内存也不会涨。None 关闭（多进程模式下不使用）
+JOB_QUEUE_PATH = None
+QUEUE_BATCH_SIZE = 200
+
+# 元数据批量预取：每次先认领这么多个资料夹，要查的商品 ID / 搜索关键字去重后同时查好，
+# 再下载图片、写 NFO、改名，元数据的等待按批付一次而不是每个资料夹一次。0 关闭（逐个资料夹查）
+# 断点续跑（JOB_QUEUE_PATH）时不预取
+PREFETCH_BATCH_SIZE = 200
+# 预取时同时发出的元数据请求数（仍然受 RATE_LIMITS 限速）
+PREFETCH_WORKERS = 8
+
+# 视频文件扩展名，NFO 会生成在包含这些文件的目录里
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.wmv')
+
+# 流水线模式：取 ID、查元数据、下图片、写 NFO、重命名分成几个阶段同时跑，
+# 多个资料夹可以同时在途，同一资料夹的步骤仍按顺序执行
+PIPELINE_MODE = False
+# 阶段之间队列的长度，限制同时在途的资料夹数量
+PIPELINE_QUEUE_SIZE = 32
+# 每个阶段的并发数，写 NFO 和重命名保持 1 个避免改名冲突
+PIPELINE_WORKERS = {"id": 1, "metadata": 8, "images": 4, "resize": 1, "nfo": 1, "rename": 1}
+
+# 每个主机的限速：(每秒请求数, 突发上限)，没列出的主机用 "default"
+# metatube 如果是自己部署的可以把它的 "IP:端口" 加进来调高
+RATE_LIMITS = {
+    "default": (5, 10),
+    "gyutto.com": (2, 4),
+    "image.gyutto.com": (5, 10),
+    "dl.getchu.com": (5, 10),
+}
+# 这些状态码和连接错误会按指数退避加随机抖动重试，次数和基础等待时间见 HTTP_PROFILES
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# 单次退避最长等待秒数
+RETRY_MAX_BACKOFF = 60
+# 重试后仍然失败的资料夹在本次运行结束前再排队重跑几轮，每轮之前等待多少秒
+REQUEUE_ROUNDS = 2
+REQUEUE_DELAY = 30
+
+# 运行统计：每个阶段的耗时、下载字节数、HTTP 状态码、缓存命中、重试次数
+# METRICS_PATH 为 JSON lines 事件文件，None 表示不写；运行结束时打印汇总表
+METRICS_PATH = None
+METRICS_SUMMARY = True
+# 只对这个资料夹名做 cProfile 分析，结果写到 PROFILE_PATH，可以用 snakeviz 等工具看
+PROFILE_FOLDER = None
+PROFILE_PATH = "scrape_profile.prof"
+
+# 图片下载每次读写的块大小
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# 已经存在的图片是否用 ETag / Last-Modified 向服务器确认有没有更新（没更新只花一个 304）
+# False 则 getchu / zidong 直接信任已有图片；gyutto 总是确认
+REVALIDATE_IMAGES = True
+
+# 下架商品的图片地址是猜的：开启时先用 HEAD 并发探测更多候选地址，只下载存在的，
+# 同一 ID 段探测到过的命名会记到缓存里下次优先用；False 则按老办法直接下载固定的几个地址
+PROBE_FALLBACK_IMAGES = True
+# 同时探测的地址数
+PROBE_WORKERS = 8
+
+# 图片内容寻址仓库：同样的图片（同一个 URL 或者内容完全相同）只下载、只存一份，
+# 各资料夹里的 poster / backdrop 用硬链接指向它（跨磁盘时退回复制）。None 关闭
+# 建议放在和媒体库同一个磁盘上，硬链接才能生效
+IMAGE_STORE_PATH = None
+
+# 图片后处理（需要 Pillow）：下载好的封面和预览图超过 IMAGE_MAX_SIZE（宽, 高）就等比缩小，
+# 超过 IMAGE_MAX_BYTES 字节就重新编码，JPEG / WebP 用 IMAGE_QUALITY 的质量，扩展名不变。
+# 两个都是 None 时关闭。例如 IMAGE_MAX_SIZE = (1920, 1920)，IMAGE_MAX_BYTES = 1024 * 1024
+IMAGE_MAX_SIZE = None
+IMAGE_MAX_BYTES = None
+IMAGE_QUALITY = 85
+# 同时处理的图片数，None 为 CPU 核数
+IMAGE_WORKERS = None
+# 处理过、检查过的图片记在这里，以后不再打开，也不会反复重新编码。None 则每次都检查
+IMAGE_RECORD_PATH = "scrape_images.sqlite3"
+
+# 监视模式：跑完一遍后不退出，盯着资料夹，有新的资料夹放进来（创建或移动进来）就刮削
+# Linux 用 inotify，其他系统每隔 WATCH_POLL_INTERVAL 秒列一次目录
+# 新资料夹内容 WATCH_QUIET_SECONDS 秒没有变化（复制/硬链接完成）后才开始处理
+WATCH_MODE = False
+WATCH_QUIET_SECONDS = 30
+WATCH_POLL_INTERVAL = 10
@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+import config
+import httpclient
+import metrics
+from imagestore import get_store
+from ratelimit import is_transient
+from validators import get_validators
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _host_semaphore(url, limit):
+    """每个主机一个信号量，限制同一主机的并发下载数"""
+    host = urlsplit(url).netloc
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(limit)
+            _host_semaphores[host] = semaphore
+    return semaphore
+
+
+def _conditional_headers(url, save_path):
+    """已有文件的重新验证请求头：有记录的 ETag 就用，否则按文件修改时间问服务器"""
+    headers = {}
+    validators = get_validators().get(url)
+    st = os.stat(save_path)
+    if validators and validators.get("size") == st.st_size:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    if not headers:
+        headers["If-Modified-Since"] = formatdate(st.st_mtime, usegmt=True)
+    return headers
+
+
+def _resume_headers(url, offset):
+    """续传请求头，必须有记录的 ETag / Last-Modified 做 If-Range，否则服务器文件变了会拼出坏图"""
+    validators = get_validators().get(url)
+    validator = (validators or {}).get("etag") or (validators or {}).get("last_modified")
+    if not validator:
+        return None
+    return {"Range": f"bytes={offset}-", "If-Range": validator}
+
+
+def _remember(url, response, size=None):
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "size": size,
+    }
+    if validators["etag"] or validators["last_modified"]:
+        get_validators().put(url, validators)
+
+
+def adopt_local_copy(url, save_path):
+    """本地改过内容（比如缩小过）的图片，把记录的大小改成现在的，重新验证时仍然用 ETag"""
+    validators = get_validators().get(url)
+    if validators:
+        validators["size"] = os.path.getsize(save_path)
+        get_validators().put(url, validators)
+
+
+def download_file(url, save_path, overwrite=False, exists=None):
+    """下载单个文件，返回 (是否成功, 说明)
+
+    先写到 save_path + ".part"，完整后再改名，中断留下的 .part 下次用 Range 续传。
+    已有的文件在 overwrite 或 config.REVALIDATE_IMAGES 时用 ETag / Last-Modified 重新验证，
+    没变就不下载。开启图片仓库时，下载过的 URL 和相同内容都用硬链接。
+    exists 为调用方已知的文件是否存在，None 则自己检查。
+    """
+    ok, message, _ = _download_file(url, save_path, overwrite, exists)
+    return ok, message
+
+
+def _download_file(url, save_path, overwrite, exists):
+    """download_file 的实现，多返回一个失败是否是暂时的（重试后还是 429/5xx、连不上、超时、没下完）"""
+    if exists is None:
+        exists = os.path.exists(save_path)
+    if exists and not (overwrite or config.REVALIDATE_IMAGES):
+        return True, "exists", False
+
+    # 仓库里已经有这个 URL 的内容，直接硬链接过来，不用请求
+    store = get_store()
+    if not exists and store is not None and store.materialize(url, save_path):
+        return True, "linked", False
+
+    part_path = save_path + ".part"
+    start = time.perf_counter()
+    size = 0
+    try:
+        headers = {}
+        offset = 0
+        if exists:
+            headers = _conditional_headers(url, save_path)
+        elif os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+            headers = (_resume_headers(url, offset) if offset else None) or {}
+            if not headers:
+                offset = 0
+
+        # with 保证连接用完放回连接池
+        with httpclient.get(url, stream=True, headers=headers) as response:
+            if response.status_code == 304:
+                return True, "not modified", False
+            if response.status_code == 416 and offset:
+                # .part 已经不对了，删掉下次重新下载
+                os.remove(part_path)
+                return False, "HTTP 416, discarded partial file", False
+            if response.status_code not in (200, 206):
+                return False, f"HTTP {response.status_code}", is_transient(response)
+            if response.status_code == 200:
+                offset = 0  # 服务器不支持续传或者文件变了，从头开始
+            # gzip / deflate 传输时 Content-Length 和 Range 都是压缩后的字节数，
+            # 写到文件里的是解压后的，这时按收到的压缩字节数核对，没下完也不能续传
+            encoded = response.headers.get("Content-Encoding", "identity").lower() not in ("", "identity")
+            if encoded and offset:
+                os.remove(part_path)
+                return False, "compressed partial response, discarded partial file", True
+            _remember(url, response)
+            expected = response.headers.get("Content-Length")
+            with open(part_path, 'ab' if offset else 'wb', buffering=config.DOWNLOAD_CHUNK_SIZE) as file:
+                for chunk in response.iter_content(config.DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    size += len(chunk)
+            received = response.raw.tell() if encoded else size
+            if expected is not None and received != int(expected):
+                if encoded:
+                    os.remove(part_path)
+                    return False, f"incomplete download ({received}/{expected} bytes)", True
+                return False, f"incomplete download ({size}/{expected} bytes), will resume", True
+            os.replace(part_path, save_path)
+            last_modified = response.headers.get("Last-Modified")
+            if last_modified:
+                # 文件时间与服务器一致，没有 ETag 时下次也能用 If-Modified-Since
+                try:
+                    mtime = parsedate_to_datetime(last_modified).timestamp()
+                    os.utime(save_path, (mtime, mtime))
+                except (TypeError, ValueError, OverflowError):
+                    pass
+            _remember(url, response, os.path.getsize(save_path))
+        if store is not None:
+            store.add(url, save_path)
+        return True, "resumed" if offset else "downloaded", False
+    except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+        return False, str(e), True
+    except Exception as e:
+        return False, str(e), False
+    finally:
+        metrics.incr("bytes downloaded", size)
+        metrics.observe("download", time.perf_counter() - start, url=url, bytes=size)
+
+
+def image_tasks(folder_path, cover_url, preview_images):
+    """把封面和预览图 URL 转成 (url, 保存路径) 任务列表"""
+    tasks = []
+    if cover_url:
+        ext = os.path.splitext(cover_url)[-1]  # 获取文件扩展名
+        tasks.append((cover_url, os.path.join(folder_path, f"poster{ext}")))
+    for idx, img_url in enumerate(preview_images):
+        ext = os.path.splitext(img_url)[-1]
+        tasks.append((img_url, os.path.join(folder_path, f"backdrop{idx + 1}{ext}")))
+    return tasks
+
+
+def download_many(tasks, overwrite=False, existing=None, max_workers=None, per_host_limit=None):
+    """并行下载一批 (url, 保存路径)，可以是一个资料夹的也可以是很多资料夹的
+
+    existing 为 scanner 索引到的已有文件路径，给了就不再逐个检查文件是否存在
+    返回与 tasks 顺序一致的结果列表，每项为 {"url", "path", "ok", "message", "transient"}
+    """
+    max_workers = max_workers or config.DOWNLOAD_WORKERS
+    per_host_limit = per_host_limit or config.PER_HOST_LIMIT
+
+    def run(task):
+        url, save_path = task
+        exists = None if existing is None else save_path in existing
+        with _host_semaphore(url, per_host_limit):
+            ok, message, transient = _download_file(url, save_path, overwrite, exists)
+        return {"url": url, "path": save_path, "ok": ok, "message": message, "transient": transient}
+
+    if not tasks:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+        return list(executor.map(run, tasks))
+
+
+def report_failures(results):
+    """打印下载失败的文件，返回失败数量"""
+    failed = [r for r in results if not r["ok"]]
+    for r in failed:
+        print(f"Failed to download {r['url']}: {r['message']}")
+    return len(failed)
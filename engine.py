@@ -0,0 +1,266 @@
+"""三个脚本共用的刮削引擎：媒体库只扫描一次，按资料夹名分给对应的来源插件
+
+每个来源（getchu / gyutto / zidong）是一个 Provider，只负责认领资料夹、查元数据和写 NFO；
+下载图片、重命名、记状态这些输出步骤由引擎统一处理。
+"""
+import os
+import re
+from itertools import chain
+
+import config
+import imageproc
+import nfo
+import pipeline
+import prefetch
+from downloader import download_many, image_tasks, report_failures
+from journal import get_journal
+from ratelimit import RetryLater
+from scanner import iter_library, scan_folder
+
+_INVALID_CHARS = re.compile(r'[<>:"/\\|?*\x00-\x1F]')
+# 资料夹名按 UTF-8 截断到的字节数
+NAME_LIMIT = 220
+
+
+def sanitize_filename(filename, limit=NAME_LIMIT):
+    """清理无效字符，确保文件名合法；limit 为 None 时不截断（拼整个名字前清理各部分用）"""
+    sanitized = _INVALID_CHARS.sub('_', filename)
+    sanitized = sanitized.replace('/', '_')  # Linux 特殊处理
+    sanitized = sanitized.rstrip(' .')  # 刪除結尾的點和空格（Windows 处理）
+    sanitized = sanitized.lstrip('.')  # 避免 Linux 隐藏文件问题
+    if limit is None:
+        return sanitized
+    sanitized = sanitized.encode('utf-8')[:limit]  # 按 UTF-8 字节截断
+    sanitized = sanitized.decode('utf-8', 'ignore')  # 忽略无效字节 限制文件名长度
+    return sanitized
+
+
+def name_bytes(filename):
+    """清理后、截断前的 UTF-8 字节数，超过 NAME_LIMIT 的名字改名时会被截断（计划模式报告用）"""
+    return len(sanitize_filename(filename, None).encode('utf-8'))
+
+
+class Provider:
+    """来源插件的公共接口
+
+    patterns 为认领资料夹的正则（第一个非空捕获组是商品 ID），item_pattern 为纯 itemXXXX
+    这种好几个来源都能认领的名字，由 config.ITEM_PROVIDER 决定给谁；fallback 为 True 的
+    来源兜底接收没被认领的资料夹（metatube 搜索）。
+    """
+
+    name = ""
+    patterns = ()
+    item_pattern = None
+    fallback = False
+    # 已有图片是否总是向服务器确认（否则看 config.REVALIDATE_IMAGES）
+    overwrite_images = False
+
+    def new_job(self, entry, item_id):
+        return {"entry": entry, "folder_path": entry.path, "item_id": item_id, "provider": self.name}
+
+    def resolve(self, job):
+        """查元数据，填好 metadata、cover_url、preview_images、new_folder_name，返回 None 表示放弃"""
+        raise NotImplementedError
+
+    def prefetch(self, jobs):
+        """并发查好一批 job 的元数据，留给之后的 resolve 用，返回 {(来源, 商品 ID): 元数据}
+
+        默认不预取，resolve 时再逐个查
+        """
+        return {}
+
+    def write_nfo(self, job):
+        """写 NFO，返回涉及的 NFO 路径"""
+        raise NotImplementedError
+
+    def nfo_paths(self, job):
+        """write_nfo 会写的 NFO 路径（计划模式用），默认是第一个有视频的目录"""
+        entry = job["entry"]
+        folder = entry.video_dirs[0] if entry.video_dirs else job["folder_path"]
+        return [os.path.join(folder, "movie.nfo")]
+
+
+class Dispatcher:
+    """按顺序排好的 (正则, 来源) 表，第一个匹配的来源认领资料夹
+
+    顺序：各来源的专用格式（[GYUTTO-XXXX]、[GETCHU-XXXX]），然后 itemXXXX（config.ITEM_PROVIDER
+    优先），最后是兜底的来源。
+    """
+
+    def __init__(self, providers):
+        self.routes = [(pattern, p) for p in providers for pattern in p.patterns]
+        item_providers = sorted((p for p in providers if p.item_pattern is not None),
+                                key=lambda p: p.name.lower() != config.ITEM_PROVIDER.lower())
+        self.routes += [(p.item_pattern, p) for p in item_providers]
+        self.fallback = next((p for p in providers if p.fallback), None)
+
+    def route(self, name):
+        """返回 (来源, 商品 ID)，没有来源认领时返回 (None, None)"""
+        for pattern, provider in self.routes:
+            match = pattern.search(name)
+            if match:
+                item_id = next((g for g in match.groups() if g), None)
+                if item_id:
+                    return provider, item_id
+        return self.fallback, None
+
+
+def fetch_images(job):
+    """封面和预览图并行下载，已存在的按设置跳过或重新验证
+
+    有图片暂时下载不了（重试后还是 429/5xx、连不上、超时）时抛出 RetryLater，
+    这个资料夹在本次运行结束前从这一步重跑，不会先写 NFO、改名
+    """
+    tasks = image_tasks(job["folder_path"], job["cover_url"], job["preview_images"])
+    results = download_many(tasks, overwrite=job["plugin"].overwrite_images, existing=job["entry"].artwork)
+    job["failures"] = report_failures(results)
+    job["produced"] = [r["path"] for r in results if r["ok"]]
+    # 重跑时已经下好的不用再下载
+    job["entry"].artwork.update(job["produced"])
+    transient = sum(1 for r in results if not r["ok"] and r["transient"])
+    if transient:
+        raise RetryLater(f"{transient} image(s) temporarily unavailable for {job['folder_path']}")
+    return job
+
+
+def postprocess_images(job):
+    """config.IMAGE_MAX_SIZE / IMAGE_MAX_BYTES 设置了的话，把过大的图片缩小重编码，见 imageproc"""
+    if not imageproc.enabled():
+        return job
+    produced = set(job["produced"])
+    tasks = [(url, path) for url, path in image_tasks(job["folder_path"], job["cover_url"], job["preview_images"])
+             if path in produced]
+    for r in imageproc.process_many(tasks):
+        if r["status"] == "failed":
+            print(f"Failed to process image {r['path']}: {r['message']}")
+    return job
+
+
+def write_nfo(job):
+    if job["metadata"]:
+        job["produced"] += job["plugin"].write_nfo(job)
+    return job
+
+
+def rename_folder(job):
+    """重命名资料夹并记录到状态记录里"""
+    folder_path = job["folder_path"]
+    if job.get("new_folder_name"):
+        new_folder_path = os.path.join(os.path.dirname(folder_path), job["new_folder_name"])
+        try:
+            # 经过 nfo.rename，批量模式下还没同步的目录跟到新名字
+            nfo.rename(folder_path, new_folder_path)
+            print(f"Renamed folder: {folder_path} -> {new_folder_path}")
+            job["produced"] = [os.path.join(new_folder_path, os.path.relpath(p, folder_path)) for p in job["produced"]]
+            job["entry"].relocate(new_folder_path)
+            job["folder_path"] = new_folder_path
+        except Exception as e:
+            print(f"Failed to rename {folder_path} to {new_folder_path}: {e}")
+
+    # 图片都下载成功才记为完成，失败的下次再试；状态记录只在增量模式和监视模式下用，
+    # 其他时候不写，也不为算指纹把资料夹再遍历一遍
+    if not job["failures"] and (config.INCREMENTAL or config.WATCH_MODE):
+        get_journal().record(job["folder_path"], job["provider"], job["item_id"], job["produced"])
+    return job
+
+
+def dump_job(job):
+    """job 里能存下来的部分（计划文件、任务队列用），来源插件只存名字"""
+    state = {key: value for key, value in job.items() if key not in ("entry", "plugin")}
+    state["plugin"] = job["plugin"].name
+    return state
+
+
+def load_job(state, plugins):
+    """dump_job 的反操作，plugins 为 {名字: 来源}，重新索引资料夹
+
+    改完名还没记下进度就中断的，资料夹已经在新名字下了，跟过去。
+    资料夹或来源找不到时返回 None
+    """
+    job = dict(state)
+    plugin = plugins.get(job.pop("plugin", None))
+    if plugin is None:
+        return None
+    folder_path = job["folder_path"]
+    if not os.path.isdir(folder_path) and job.get("new_folder_name"):
+        renamed = os.path.join(os.path.dirname(folder_path), job["new_folder_name"])
+        if os.path.isdir(renamed):
+            job["produced"] = [os.path.join(renamed, os.path.relpath(p, folder_path)) for p in job.get("produced", [])]
+            job["folder_path"] = folder_path = renamed
+            job["new_folder_name"] = None
+    if not os.path.isdir(folder_path):
+        return None
+    job["entry"] = scan_folder(folder_path, with_stats=config.INCREMENTAL)
+    job["plugin"] = plugin
+    return job
+
+
+def build_stages(providers):
+    """每个资料夹要经过的步骤，逐个执行和流水线模式共用"""
+    dispatcher = Dispatcher(providers)
+
+    def claim(entry):
+        # 增量模式下跳过上次已经刮完且没变过的资料夹
+        if config.INCREMENTAL and get_journal().is_complete(entry.path, entry.files):
+            return None
+        provider, item_id = dispatcher.route(entry.name)
+        if provider is None:
+            print(f"No provider for folder: {entry.name}")
+            return None
+        job = provider.new_job(entry, item_id)
+        job["plugin"] = provider
+        return job
+
+    return [
+        ("id", claim),
+        ("metadata", lambda job: job["plugin"].resolve(job)),
+        ("images", fetch_images),
+        ("resize", postprocess_images),
+        ("nfo", write_nfo),
+        ("rename", rename_folder),
+    ]
+
+
+def run_stages(entries, stages, finish=True):
+    """config.PREFETCH_BATCH_SIZE > 0 时按批预取元数据（见 prefetch），否则直接交给 pipeline"""
+    if config.PREFETCH_BATCH_SIZE > 0:
+        prefetch.run(entries, stages, finish)
+    else:
+        pipeline.run(entries, stages, finish)
+
+
+def iter_roots(roots):
+    """依次索引几个根目录下的资料夹"""
+    return chain.from_iterable(iter_library(root, with_stats=config.INCREMENTAL) for root in roots)
+
+
+def process_folders(base_dir, providers, folders=None):
+    """处理 base_dir 和 config.MEDIA_ROOTS 下的资料夹，folders 为资料夹路径列表时只处理这些（监视模式用）
+
+    config.PLAN_MODE 为 "plan" / "execute" 时改为生成计划 / 执行保存的计划，见 planner
+    """
+    roots = [base_dir] + [root for root in config.MEDIA_ROOTS if root != base_dir]
+    if config.PLAN_MODE:
+        import planner
+        if config.PLAN_MODE == "plan":
+            planner.plan(roots, providers, folders)
+        else:
+            planner.execute(providers)
+        return
+    if config.PROCESS_WORKERS != 1:
+        from multiroot import process_roots
+        process_roots(roots, providers, folders, config.PROCESS_WORKERS)
+        return
+    if config.JOB_QUEUE_PATH:
+        import jobqueue
+        jobqueue.run(roots, providers, folders)
+        return
+    # 整个目录只遍历一次，后面都用索引
+    if folders is not None:
+        entries = iter_library(base_dir, with_stats=config.INCREMENTAL, only=folders)
+    else:
+        entries = iter_roots(roots)
+    try:
+        run_stages(entries, build_stages(providers))
+    finally:
+        nfo.flush()
@@ -0,0 +1,70 @@
+"""下架商品的图片地址：按已知的几种命名生成候选地址，并发 HEAD 探测，只下载存在的
+
+封面只要第一个存在的：每个 ID 段（商品 ID 每 1000 个一段）哪些命名探测到过会记到缓存里，
+同一段的下一个商品先只探测这些封面命名，一个都没找到时再探测其余的。预览图张数每个商品不同，
+记下的命名只决定先探测哪些，其余的候选照样探测。
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import config
+import httpclient
+import metrics
+from cache import get_cache
+
+
+def exists(url):
+    """HEAD 探测地址是否存在，服务器不支持 HEAD 时改用只要 1 个字节的 GET"""
+    try:
+        response = httpclient.head(url, allow_redirects=True)
+        if response.status_code in (405, 501):
+            with httpclient.get(url, headers={"Range": "bytes=0-0"}, stream=True) as response:
+                pass
+    except requests.RequestException:
+        return False
+    if response.status_code not in (200, 206):
+        return False
+    # 有的 CDN 对不存在的图片返回 200 的 HTML 错误页
+    content_type = response.headers.get("Content-Type", "image/")
+    return content_type.startswith("image/")
+
+
+def _range_key(provider, item_id):
+    return f"{provider}:{int(item_id) // 1000 if item_id.isdigit() else item_id}"
+
+
+def _probe(candidates):
+    """并发探测 [(名字, 地址)]，返回存在的名字集合"""
+    if not candidates:
+        return set()
+    with ThreadPoolExecutor(max_workers=min(config.PROBE_WORKERS, len(candidates))) as executor:
+        found = list(executor.map(lambda c: exists(c[1]), candidates))
+    hits = {name for (name, _), ok in zip(candidates, found) if ok}
+    metrics.incr("probe hit", len(hits))
+    metrics.incr("probe miss", len(candidates) - len(hits))
+    return hits
+
+
+def resolve(provider, item_id, covers, previews):
+    """covers / previews 为按优先顺序排好的 [(命名, 地址)]
+
+    返回 (封面地址, [预览图地址])，只包含探测到存在的，封面取第一个存在的
+    """
+    key = _range_key(provider, item_id)
+    hit, known = get_cache().get("probe", key)
+    known = set(known or ())
+
+    # 记下的封面命名和全部预览图一起探测，记下的排在前面
+    first = [c for c in covers if c[0] in known]
+    hits = _probe(first + sorted(previews, key=lambda c: c[0] not in known))
+    # 记下的封面命名都不存在时，再探测其余的封面
+    if not any(name in hits for name, _ in first):
+        hits |= _probe([c for c in covers if c[0] not in known])
+    if hits - known:
+        # 保持候选顺序，缓存里的内容每次都一样
+        get_cache().put("probe", key, [name for name, _ in list(covers) + list(previews) if name in hits | known])
+
+    cover_url = next((url for name, url in covers if name in hits), "")
+    preview_images = [url for name, url in previews if name in hits]
+    return cover_url, preview_images
@@ -3,6 +3,18 @@ import requests
 import re
 from datetime import datetime
 
+import config
+import engine
+import fallback
+import httpclient
+import nfo
+from cache import get_cache
+from engine import Provider, name_bytes, sanitize_filename
+from prefetch import fetch_many, lookup
+from ratelimit import RetryLater, is_transient
+from scanner import scan_folder
+from watcher import watch
+
 # 开关变量：是否重命名文件夹
 # True 开启 False 关闭
 RENAME_FOLDERS = True
@@ -10,44 +22,49 @@ RENAME_FOLDERS = True
 base_directory = r"C:\\Users\\用户名\\Desktop\\12345\\python"
 # metatube，把http://10.0.0.189:123 换成你的metatube与端口
 metatube_service_url = "http://10.0.0.189:123/v1/movies/Getchu"
+# 下架商品的图片地址
+getchu_image_url = "https://dl.getchu.com"
 
 def get_metadata(base_url, item_id):
+    hit, metadata = get_cache().get("Getchu", item_id)
+    if hit:
+        return metadata or {}
     url = f"{base_url}/{item_id}"
-    response = requests.get(url)
+    try:
+        response = httpclient.get(url)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise RetryLater(f"Failed to fetch metadata for {item_id}: {e}")
+    except requests.RequestException as e:
+        print(f"Failed to fetch metadata for {item_id}: {e}")
+        return {}
+    if is_transient(response):
+        # 重试过还是 429/5xx，交给本次运行结束前的重跑，别当成下架
+        raise RetryLater(f"Failed to fetch metadata for {item_id}: {response.status_code}")
     if response.status_code == 200:
-        return response.json().get("data", {})
+        metadata = response.json().get("data", {})
+        get_cache().put("Getchu", item_id, metadata)  # 空结果记为下架
+        return metadata
     else:
         print(f"Failed to fetch metadata for {item_id}: {response.status_code}")
+        if response.status_code == 404:
+            get_cache().put("Getchu", item_id, {})
         return {}
 
-def download_file(url, save_path):
-    if os.path.exists(save_path):
-        print(f"File already exists, skipping download: {save_path}")
-        return
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        with open(save_path, 'wb') as file:
-            for chunk in response.iter_content(1024):
-                file.write(chunk)
-    else:
-        print(f"Failed to download {url}: {response.status_code}")
+# 下架商品可能存在的图片命名，封面按顺序取第一个存在的
+SPECIAL_COVERS = ("top.jpg", ".jpg", "package.jpg")
+SPECIAL_PREVIEWS = tuple(f"_{i}.jpg" for i in range(2970, 2990))
 
 def get_special_image_urls(item_id):
     base_id = item_id[:-2] if len(item_id) > 2 else item_id
-    base_path = f"https://dl.getchu.com/data/item_img/{base_id}/{item_id}/"
-    cover_url = f"{base_path}{item_id}top.jpg"
-    preview_images = [f"{base_path}{item_id}_{i}.jpg" for i in range(2977, 2980)]
-    return cover_url, preview_images
-
-def sanitize_filename(filename):
-    invalid_chars = r'[<>:"/\\|?*\x00-\x1F]'
-    sanitized = re.sub(invalid_chars, '_', filename)
-    sanitized = sanitized.replace('/', '_')  # Linux 特殊处理
-    sanitized = sanitized.rstrip(' .')  # 刪除結尾的點和空格（Windows 处理）
-    sanitized = sanitized.lstrip('.')  # 避免 Linux 隐藏文件问题
-    sanitized = sanitized.encode('utf-8')[:220]  # 按 UTF-8 字节截断
-    sanitized = sanitized.decode('utf-8', 'ignore')  # 忽略无效字节 限制文件名长度
-    return sanitized
+    base_path = f"{getchu_image_url}/data/item_img/{base_id}/{item_id}/"
+    if not config.PROBE_FALLBACK_IMAGES:
+        cover_url = f"{base_path}{item_id}top.jpg"
+        preview_images = [f"{base_path}{item_id}_{i}.jpg" for i in range(2977, 2980)]
+        return cover_url, preview_images
+    # 先探测哪些存在，只下载存在的
+    covers = [(name, f"{base_path}{item_id}{name}") for name in SPECIAL_COVERS]
+    previews = [(name, f"{base_path}{item_id}{name}") for name in SPECIAL_PREVIEWS]
+    return fallback.resolve("Getchu", item_id, covers, previews)
 
 def format_date(release_date):
     try:
@@ -56,111 +73,105 @@ def format_date(release_date):
     except ValueError:
         return ""
 
-def create_nfo(metadata, folder_path, item_id):
-    # 存储所有包含视频文件的目录
-    video_dirs = []
-
-    # 遍历文件夹查找视频文件
-    for root, _, files in os.walk(folder_path):
-        if any(f.lower().endswith(('mp4', 'mkv', 'avi', 'mov')) for f in files):
-            video_dirs.append(root)
+def create_nfo(metadata, folder_path, item_id, entry=None):
+    """生成 NFO，返回涉及的 NFO 路径，entry 为 scanner 的资料夹索引"""
+    if entry is None:
+        entry = scan_folder(folder_path)
+    # 所有包含视频文件的目录
+    video_dirs = entry.video_dirs
 
     # 如果找到多个包含视频文件的目录
     if video_dirs:
+        nfo_files = []
         for video_dir in video_dirs:
             nfo_filename = os.path.join(video_dir, "movie.nfo")
-            if os.path.exists(nfo_filename):
+            nfo_files.append(nfo_filename)
+            if nfo_filename in entry.nfo_files:
                 print(f"NFO file already exists, skipping creation: {nfo_filename}")
                 continue
             write_nfo_file(metadata, nfo_filename)
+        return nfo_files
     else:
         # 如果没有视频文件，在根目录生成NFO
         nfo_filename = os.path.join(folder_path, "movie.nfo")
-        if os.path.exists(nfo_filename):
+        if nfo_filename in entry.nfo_files:
             print(f"NFO file already exists, skipping creation: {nfo_filename}")
-            return
+            return [nfo_filename]
         write_nfo_file(metadata, nfo_filename)
+        return [nfo_filename]
+
+NFO_TEMPLATE = nfo.Template("title", "number", "director", "year", "plot", "genre*", "premiered", "tagline", "poster")
 
 def write_nfo_file(metadata, nfo_filename):
     try:
-        os.makedirs(os.path.dirname(nfo_filename), exist_ok=True)
-        with open(nfo_filename, 'w', encoding='utf-8') as nfo_file:
-            plot = metadata.get("summary", "").strip()
-            genres = metadata.get("genres", [])
-            formatted_genres = "".join([f"    <genre>{genre}</genre>\n" for genre in genres])
-            release_date = metadata.get("release_date", "")
-            formatted_date = format_date(release_date)
-
-            nfo_content = f"""<?xml version="1.0" encoding="UTF-8"?>
-<movie>
-    <title>{metadata.get('title', '')}</title>
-    <number>{metadata.get('number', '')}</number>
-    <director>{metadata.get('label', '')}</director>
-    <year>{formatted_date[:4]}</year>
-    <plot>{plot}</plot>
-{formatted_genres}    <premiered>{formatted_date}</premiered>
-    <tagline>{metadata.get('title', '')}</tagline>
-    <poster>{metadata.get("cover_url", "")}</poster>
-</movie>
-"""
-            nfo_file.write(nfo_content)
-        print(f"Created NFO file: {nfo_filename}")
+        formatted_date = format_date(metadata.get("release_date", ""))
+        content = NFO_TEMPLATE.render(
+            title=metadata.get('title', ''),
+            number=metadata.get('number', ''),
+            director=metadata.get('label', ''),
+            year=formatted_date[:4],
+            plot=metadata.get("summary", "").strip(),
+            genre=metadata.get("genres", []),
+            premiered=formatted_date,
+            tagline=metadata.get('title', ''),
+            poster=metadata.get("cover_url", ""),
+        )
+        if nfo.write(nfo_filename, content):
+            print(f"Created NFO file: {nfo_filename}")
     except Exception as e:
         print(f"Failed to create NFO file for {nfo_filename}: {e}")
 
 
-def process_folders(base_dir, metatube_url):
-    for folder in os.listdir(base_dir):
-        folder_path = os.path.join(base_dir, folder)
+class GetchuProvider(Provider):
+    """[GETCHU-XXXX] / itemXXXX，经 metatube 的 Getchu 接口查元数据，下架的商品改用特殊图片地址"""
 
-        if not os.path.isdir(folder_path):
-            continue
+    name = "Getchu"
+    patterns = (re.compile(r'\[(?:GETCHU-)?(\d+)\]'),)
+    item_pattern = re.compile(r'item(\d+)')
 
-        item_id_match = re.search(r'(?:item(\d+)|\[(?:GETCHU-)?(\d+)\])', folder)
-        if item_id_match:
-            item_id = item_id_match.group(1) or item_id_match.group(2)
-        else:
-            print(f"Failed to extract item_id from folder name: {folder}")
-            continue
+    def __init__(self, metatube_url):
+        self.metatube_url = metatube_url
+        self.prefetched = {}
+
+    def prefetch(self, jobs):
+        self.prefetched = fetch_many(lambda item_id: get_metadata(self.metatube_url, item_id),
+                                     (job["item_id"] for job in jobs))
+        return {(self.name, item_id): metadata for item_id, metadata in self.prefetched.items()}
 
-        metadata = get_metadata(metatube_url, item_id)
+    def resolve(self, job):
+        item_id = job["item_id"]
+        metadata = lookup(self.prefetched, item_id, lambda: get_metadata(self.metatube_url, item_id))
+        job["metadata"] = metadata
+        job["new_folder_name"] = None
         if metadata:
-            number = metadata.get("number", "")
-            label = metadata.get("label", "")
-            title = metadata.get("title", "")
-            cover_url = metadata.get("cover_url", "")
-            preview_images = metadata.get("preview_images", [])
-            sanitized_number = sanitize_filename(number)
-            sanitized_label = sanitize_filename(label)
-            sanitized_title = sanitize_filename(title)
+            job["cover_url"] = metadata.get("cover_url", "")
+            job["preview_images"] = metadata.get("preview_images", [])
+            if RENAME_FOLDERS:
+                sanitized_number = sanitize_filename(metadata.get("number", ""), None)
+                sanitized_label = sanitize_filename(metadata.get("label", ""), None)
+                sanitized_title = sanitize_filename(metadata.get("title", ""), None)
+                new_folder_name = f"[{sanitized_number}][{sanitized_label}]{sanitized_title}"
+                job["new_folder_name"] = sanitize_filename(new_folder_name)
+                job["name_bytes"] = name_bytes(new_folder_name)
         else:
-            cover_url, preview_images = get_special_image_urls(item_id)
-
-        if cover_url:
-            ext = os.path.splitext(cover_url)[-1]  # 获取文件扩展名
-            poster_path = os.path.join(folder_path, f"poster{ext}")
-            download_file(cover_url, poster_path)
+            job["cover_url"], job["preview_images"] = get_special_image_urls(job["item_id"])
+        return job
 
-        for idx, img_url in enumerate(preview_images):
-            ext = os.path.splitext(img_url)[-1]
-            preview_path = os.path.join(folder_path, f"backdrop{idx+1}{ext}")
-            download_file(img_url, preview_path)
+    def write_nfo(self, job):
+        return create_nfo(job["metadata"], job["folder_path"], job["item_id"], job["entry"])
 
-        
-        if metadata:
-            create_nfo(metadata, folder_path, item_id)
-
-        if RENAME_FOLDERS and metadata:
-            new_folder_name = f"[{sanitized_number}][{sanitized_label}]{sanitized_title}"
-            new_folder_name = sanitize_filename(new_folder_name)
-            new_folder_path = os.path.join(base_dir, new_folder_name)
+    def nfo_paths(self, job):
+        # 每个有视频的目录各一个，没有视频就在资料夹根目录
+        folders = job["entry"].video_dirs or [job["folder_path"]]
+        return [os.path.join(folder, "movie.nfo") for folder in folders]
 
-            try:
-                os.rename(folder_path, new_folder_path)
-                print(f"Renamed folder: {folder_path} -> {new_folder_path}")
-            except Exception as e:
-                print(f"Failed to rename {folder_path} to {new_folder_path}: {e}")
+def process_folders(base_dir, metatube_url, folders=None):
+    """folders 为资料夹路径列表时只处理这些（监视模式用）"""
+    engine.process_folders(base_dir, [GetchuProvider(metatube_url)], folders)
 
 if __name__ == "__main__":
+    httpclient.register_host(metatube_service_url, "metatube")
     process_folders(base_directory, metatube_service_url)
-
+    # 监视模式：之后放进来的新资料夹自动刮削
+    if config.WATCH_MODE:
+        watch(base_directory, lambda folders: process_folders(base_directory, metatube_service_url, folders))
@@ -1,17 +1,157 @@
 import os
 import requests
 import re
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import xml.etree.ElementTree as ET
 
+import config
+import engine
+import fallback
+import httpclient
+import metrics
+import nfo
+from cache import get_cache
+from engine import Provider, name_bytes, sanitize_filename
+from ratelimit import RetryLater, is_transient
+from scanner import scan_folder
+from watcher import watch
+
+# Site and image host, overridable (e.g. by benchmark.py's local stand-in)
+GYUTTO_URL = "https://gyutto.com"
+GYUTTO_IMAGE_URL = "https://image.gyutto.com"
+
 def fetch_metadata(item_id):
-    url = f"https://gyutto.com/i/item{item_id}"
-    response = requests.get(url)
+    hit, metadata = get_cache().get("Gyutto", item_id)
+    if hit:
+        return metadata or {}
+
+    url = f"{GYUTTO_URL}/i/item{item_id}"
+    try:
+        response = httpclient.get(url)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise RetryLater(f"Failed to fetch page for {item_id}: {e}")
+    except requests.RequestException as e:
+        print(f"Failed to fetch page for {item_id}: {e}")
+        return {}
+    if is_transient(response):
+        # Still 429/5xx after retries: requeue instead of treating it as delisted
+        raise RetryLater(f"Failed to fetch page for {item_id}: {response.status_code}")
     if response.status_code != 200:
         print(f"Failed to fetch page for {item_id}: {response.status_code}")
         return {}
 
-    soup = BeautifulSoup(response.text, 'html.parser')
+    with metrics.timed("parse", item_id=item_id):
+        metadata = parse_item_page(response.text, item_id)
+    if metadata is None:
+        return {}  # Parse error, don't cache it
+    get_cache().put("Gyutto", item_id, metadata)  # 下架商品 ({}) 按 negative 缓存
+    return metadata
+
+# Page regions the metadata lives in; everything else is skipped while parsing
+_PAGE_REGIONS = {"parts_Mds01", "unit_DojinMainPh", "unit_SamplePhSmall", "unit_DetailSummary"}
+
+def _is_page_region(name, attrs):
+    if name == "dl":
+        return True
+    if name != "div":
+        return False
+    classes = attrs.get("class") or []
+    if isinstance(classes, str):
+        classes = classes.split()
+    return not _PAGE_REGIONS.isdisjoint(classes)
+
+try:
+    from bs4.filter import ElementFilter  # bs4 >= 4.13
+except ImportError:
+    ElementFilter = None
+
+if ElementFilter is not None:
+    class _PageRegionFilter(ElementFilter):
+        def allow_tag_creation(self, nsprefix, name, attrs):
+            return _is_page_region(name, attrs or {})
+
+        def allow_string_creation(self, string):
+            return False
+
+    _PAGE_FILTER = _PageRegionFilter()
+else:
+    # Older bs4 calls a SoupStrainer name function with (name, attrs) while parsing
+    _PAGE_FILTER = SoupStrainer(_is_page_region)
+
+# Same parser as parse_item_page_legacy: lxml repairs malformed markup differently
+# (e.g. a <div> inside a <p>), which would change the metadata; the restricted tree
+# is where the speedup comes from
+_PARSER = "html.parser"
+
+def _definition_pairs(soup):
+    """Collect every dt -> following dd pair in one pass, in document order"""
+    pairs = []
+    for dt in soup.find_all("dt"):
+        dd = dt.find_next_sibling()
+        if dd is not None and dd.name == "dd":
+            pairs.append((dt.text, dd))
+    return pairs
+
+def _first_dd(pairs, label):
+    return next((dd for dt_text, dd in pairs if label in dt_text), None)
+
+def parse_item_page(html, item_id):
+    """Parse a gyutto.com item page into the metadata dict
+
+    Only the page regions holding metadata are built into the tree, and the
+    dt/dd pairs are collected once instead of rescanning the page per field.
+    Returns {} for a delisted item and None when the page can't be parsed;
+    must stay equivalent to parse_item_page_legacy.
+    """
+    soup = BeautifulSoup(html, _PARSER, parse_only=_PAGE_FILTER)
+
+    # Extract title to check if the item is down-sold
+    title_node = soup.select_one('div.parts_Mds01.clearfix h1')
+    title = title_node.text.strip() if title_node else ""
+
+    # Check if the title contains "エラーが発生しました。" (error message)
+    if "エラーが発生しました。" in title:
+        return {}  # Item is down-sold, return empty dict
+
+    try:
+        cover_node = soup.select_one('div.unit_DojinMainPh a.highslide img')
+        cover_url = f"{GYUTTO_URL}{cover_node['src']}" if cover_node else ""
+
+        preview_nodes = soup.select('div.unit_SamplePhSmall a.highslide img')
+        preview_images = [f"{GYUTTO_URL}{node['src']}" for node in preview_nodes]
+
+        pairs = _definition_pairs(soup)
+
+        club_node = next((a for dt_text, dd in pairs if "サークル" in dt_text for a in dd.find_all("a")), None)
+        club_name = club_node.text.strip() if club_node else ""
+
+        tags = [a.text.strip() for dt_text, dd in pairs if "ジャンル" in dt_text for a in dd.find_all("a")]
+
+        release_node = _first_dd(pairs, "配信開始日")
+        release_date = release_node.text.strip() if release_node else ""
+
+        # Extract description
+        description_node = soup.select_one('div.unit_DetailSummary.clearfix p, div.unit_DetailSummary.clearfix div.ItemLead')
+        description = description_node.text.strip() if description_node else ""
+
+    except (AttributeError, KeyError) as e:
+        print(f"Error parsing metadata for {item_id}: {e}")
+        return None
+
+    return {
+        "number": f"GYUTTO-{item_id}",
+        "label": club_name,
+        "title": title,
+        "cover_url": cover_url,
+        "preview_images": preview_images,
+        "tags": tags,
+        "release_date": release_date,
+        "description": description  # Add description to metadata
+    }
+
+def parse_item_page_legacy(html, item_id):
+    """Original full-tree parser, kept as the reference for parse_item_page"""
+    soup = BeautifulSoup(html, 'html.parser')
 
     # Extract title to check if the item is down-sold
     try:
@@ -19,7 +159,7 @@ def fetch_metadata(item_id):
         title = title_node.text.strip() if title_node else ""
     except AttributeError as e:
         print(f"Error parsing metadata for {item_id}: {e}")
-        return {}
+        return None
 
     # Check if the title contains "エラーが発生しました。" (error message)
     if "エラーが発生しました。" in title:
@@ -28,18 +168,18 @@ def fetch_metadata(item_id):
     # Extract other metadata if the item is available
     try:
         cover_node = soup.select_one('div.unit_DojinMainPh a.highslide img')
-        cover_url = f"https://gyutto.com{cover_node['src']}" if cover_node else ""
+        cover_url = f"{GYUTTO_URL}{cover_node['src']}" if cover_node else ""
 
         preview_nodes = soup.select('div.unit_SamplePhSmall a.highslide img')
-        preview_images = [f"https://gyutto.com{node['src']}" for node in preview_nodes]
+        preview_images = [f"{GYUTTO_URL}{node['src']}" for node in preview_nodes]
 
-        club_node = soup.select_one('dt:contains("サークル") + dd a')
+        club_node = soup.select_one('dt:-soup-contains("サークル") + dd a')
         club_name = club_node.text.strip() if club_node else ""
 
-        tags_nodes = soup.select('dt:contains("ジャンル") + dd a')
+        tags_nodes = soup.select('dt:-soup-contains("ジャンル") + dd a')
         tags = [tag.text.strip() for tag in tags_nodes]
 
-        release_node = soup.select_one('dt:contains("配信開始日") + dd')
+        release_node = soup.select_one('dt:-soup-contains("配信開始日") + dd')
         release_date = release_node.text.strip() if release_node else ""
 
         # Extract description
@@ -48,7 +188,7 @@ def fetch_metadata(item_id):
 
     except AttributeError as e:
         print(f"Error parsing metadata for {item_id}: {e}")
-        return {}
+        return None
 
     return {
         "number": f"GYUTTO-{item_id}",
@@ -62,41 +202,11 @@ def fetch_metadata(item_id):
     }
 
 
-def download_file(url, save_path):
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        with open(save_path, 'wb') as file:
-            for chunk in response.iter_content(1024):
-                file.write(chunk)
-    else:
-        print(f"Failed to download {url}: {response.status_code}")
-
-def sanitize_filename(filename):
-    invalid_chars = r'[<>:"/\\|?*\x00-\x1F]'
-    sanitized = re.sub(invalid_chars, '_', filename)
-    sanitized = sanitized.replace('/', '_')  # Linux 特殊处理
-    sanitized = sanitized.rstrip(' .')  # 刪除結尾的點和空格（Windows 处理）
-    sanitized = sanitized.lstrip('.')  # 避免 Linux 隐藏文件问题
-    sanitized = sanitized.encode('utf-8')[:220]  # 按 UTF-8 字节截断
-    sanitized = sanitized.decode('utf-8', 'ignore')  # 忽略无效字节 限制文件名长度
-    return sanitized
-
-# Function to check if the folder contains a valid video file
-def contains_video_file(folder_path):
-    video_extensions = ['.mp4', '.mkv', '.avi', '.mov', '.wmv']
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if any(file.lower().endswith(ext) for ext in video_extensions):
-                return True, os.path.join(root, file)  # Return the video file path if found
-    return False, None
-
-def create_nfo(metadata, folder_path):
+NFO_TEMPLATE = nfo.Template("title", "year", "genre*", "plot", "tagline", "director", "poster")
+
+def create_nfo(metadata, folder_path, entry=None):
     if not metadata:
-        return
-    
-    # 创建 genre 部分
-    tags = list(set(metadata.get("tags", [])))  # 使用 set 去重
-    genres = "\n".join([f"    <genre>{genre}</genre>" for genre in tags])
+        return []
 
     # 提取年份并移除“年”、“月”、“日”
     release_date = metadata.get("release_date", "")
@@ -108,100 +218,93 @@ def create_nfo(metadata, folder_path):
     else:
         year = ""  # 如果没有匹配到年份，则为空
 
-    nfo_content = f"""<?xml version="1.0" encoding="UTF-8"?>
-<movie>
-    <title>{metadata.get("title", "")}</title>
-    <year>{year}</year>
-{genres}
-    <plot>{metadata.get("description", "")}</plot>
-    <tagline>{metadata.get("title", "")}</tagline>
-    <director>{metadata.get("label", "")}</director>
-    <poster>{metadata.get("cover_url", "")}</poster>
-</movie>"""
-
-    # Check if a video file is present in the current folder or subfolders
-    has_video, video_file_path = contains_video_file(folder_path)
+    nfo_content = NFO_TEMPLATE.render(
+        title=metadata.get("title", ""),
+        year=year,
+        # Dedupe keeping page order, so reruns render identical files
+        genre=list(dict.fromkeys(metadata.get("tags", []))),
+        plot=metadata.get("description", ""),
+        tagline=metadata.get("title", ""),
+        director=metadata.get("label", ""),
+        poster=metadata.get("cover_url", ""),
+    )
+
+    # Look up the first folder holding a video file in the scanner index
+    if entry is None:
+        entry = scan_folder(folder_path)
     
     # If video file is found in subfolder, place the nfo in the same folder as the video file
-    if has_video:
-        nfo_folder = os.path.dirname(video_file_path)
+    if entry.video_dirs:
+        nfo_folder = entry.video_dirs[0]
     else:
         nfo_folder = folder_path  # Use the original folder if no video file is found
 
-    # Save the nfo file in the determined folder
+    # Save the nfo file in the determined folder; unchanged files are left alone
     nfo_filename = os.path.join(nfo_folder, "movie.nfo")
-    with open(nfo_filename, 'w', encoding='utf-8') as nfo_file:
-        nfo_file.write(nfo_content)
-
-def process_folders(base_dir):
-    pattern = re.compile(r'^\[?gyutto-?(\d+)\]?(?:\D.*|\d*)?$|^item(\d+)$', re.IGNORECASE)
-    
-    for folder in os.listdir(base_dir):
-        folder_path = os.path.join(base_dir, folder)
-        
-        if not os.path.isdir(folder_path) or not pattern.match(folder):
-            continue
-
-        match = pattern.match(folder)
-        if not match:
-            continue
-        
-        # 提取 item ID
-        item_id = match.group(1) or match.group(2)
-        if not item_id:
-            continue
-
-        # Fetch metadata
+    nfo.write(nfo_filename, nfo_content)
+    return [nfo_filename]
+
+# Image names a delisted item may still have; the first cover found wins
+FALLBACK_COVERS = (".jpg", "_main.jpg")
+FALLBACK_PREVIEWS = tuple(f"_{n}.jpg" for n in range(430, 440))
+
+def fallback_image_urls(item_id):
+    """Guess image URLs for a delisted item, probing which ones exist first"""
+    base_path = f"{GYUTTO_IMAGE_URL}/data/item_img/{item_id[:-2]}/{item_id}/"
+    if not config.PROBE_FALLBACK_IMAGES:
+        return f"{base_path}{item_id}.jpg", [f"{base_path}{item_id}_{n}.jpg" for n in range(430, 433)]
+    covers = [(name, f"{base_path}{item_id}{name}") for name in FALLBACK_COVERS]
+    previews = [(name, f"{base_path}{item_id}{name}") for name in FALLBACK_PREVIEWS]
+    return fallback.resolve("Gyutto", item_id, covers, previews)
+
+class GyuttoProvider(Provider):
+    """[GYUTTO-XXXX] / itemXXXX, scraped straight from the gyutto.com item page"""
+
+    name = "Gyutto"
+    patterns = (re.compile(r'^\[?gyutto-?(\d+)\]?(?:\D.*|\d*)?$', re.IGNORECASE),)
+    item_pattern = re.compile(r'^item(\d+)$', re.IGNORECASE)
+    # Existing images are revalidated with ETag / Last-Modified instead of re-downloaded
+    overwrite_images = True
+
+    def resolve(self, job):
+        """Fetch metadata and work out image URLs and the new folder name"""
+        item_id = job["item_id"]
         metadata = fetch_metadata(item_id)
-
-        # Initialize new_folder_name as empty string
-        new_folder_name = ""
+        job["metadata"] = metadata
 
         if not metadata:
             # If metadata is empty, just use Gyutto-ID for folder name
             new_folder_name = f"Gyutto-{item_id}"
-            cover_url = f"https://image.gyutto.com/data/item_img/{item_id[:-2]}/{item_id}/{item_id}.jpg"
-            preview_images = [
-                f"https://image.gyutto.com/data/item_img/{item_id[:-2]}/{item_id}/{item_id}_430.jpg",
-                f"https://image.gyutto.com/data/item_img/{item_id[:-2]}/{item_id}/{item_id}_431.jpg",
-                f"https://image.gyutto.com/data/item_img/{item_id[:-2]}/{item_id}/{item_id}_432.jpg"
-            ]
+            job["cover_url"], job["preview_images"] = fallback_image_urls(item_id)
         else:
             # If metadata is available, use the format [Gyutto-ID][label]title
-            sanitized_number = sanitize_filename(metadata.get("number", ""))
-            sanitized_label = sanitize_filename(metadata.get("label", ""))
-            sanitized_title = sanitize_filename(metadata.get("title", ""))
-            
+            # Parts are not truncated on their own; the whole name is cut below
+            sanitized_number = sanitize_filename(metadata.get("number", ""), None)
+            sanitized_label = sanitize_filename(metadata.get("label", ""), None)
+            sanitized_title = sanitize_filename(metadata.get("title", ""), None)
+
             # Construct folder name in the format [Gyutto-ID][label]title
             new_folder_name = f"[{sanitized_number}][{sanitized_label}]{sanitized_title}"
-            
-            cover_url = metadata.get("cover_url", "")
-            preview_images = metadata.get("preview_images", [])
-
-        # Sanitize folder name
-        new_folder_name = sanitize_filename(new_folder_name)
 
-        # Download cover and preview images
-        if cover_url:
-            ext = os.path.splitext(cover_url)[-1]  # 获取文件扩展名
-            poster_path = os.path.join(folder_path, f"poster{ext}")  # 动态生成文件名
-            download_file(cover_url, poster_path)
+            job["cover_url"] = metadata.get("cover_url", "")
+            job["preview_images"] = metadata.get("preview_images", [])
 
-        for idx, img_url in enumerate(preview_images):
-            ext = os.path.splitext(img_url)[-1]
-            download_file(img_url, os.path.join(folder_path, f"backdrop{idx + 1}{ext}"))
+        # Sanitize folder name; the untruncated length is kept for the plan report
+        job["new_folder_name"] = sanitize_filename(new_folder_name)
+        job["name_bytes"] = name_bytes(new_folder_name)
+        return job
 
-        # Rename folder
-        new_folder_path = os.path.join(base_dir, new_folder_name)
-        try:
-            os.rename(folder_path, new_folder_path)
-        except Exception as e:
-            print(f"Failed to rename {folder_path} to {new_folder_path}: {e}")
+    def write_nfo(self, job):
+        return create_nfo(job["metadata"], job["folder_path"], job["entry"])
 
-        # Generate NFO file in the correct location
-        create_nfo(metadata, new_folder_path)
+def process_folders(base_dir, folders=None):
+    """folders limits the run to these folder paths (used by watch mode)"""
+    engine.process_folders(base_dir, [GyuttoProvider()], folders)
 
 if __name__ == "__main__":
     #文件位置 替换成你要刮削的资料夹文件名，如果是windows要把路径的\换成\\
     base_directory = r"C:\\Users\\用户名\\Desktop\\12345\\python"
     process_folders(base_directory)
+    # Watch mode: scrape new folders as they show up
+    if config.WATCH_MODE:
+        watch(base_directory, lambda folders: process_folders(base_directory, folders))
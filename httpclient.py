@@ -0,0 +1,83 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+import metrics
+import ratelimit
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+# 脚本注册的主机 -> 连接池名称，比如 metatube 的地址
+_registered_hosts = {}
+
+
+def register_host(url, profile):
+    """指定某个地址的主机使用哪个连接池，如 register_host(metatube_url, "metatube")"""
+    _registered_hosts[urlsplit(url).netloc] = profile
+
+
+def registered_hosts():
+    """已注册的 {主机: 连接池名称}，多进程模式下带给工作进程"""
+    return dict(_registered_hosts)
+
+
+def profile_for(url):
+    """根据主机判断使用哪个连接池"""
+    host = urlsplit(url).netloc
+    if host in _registered_hosts:
+        return _registered_hosts[host]
+    hostname = host.split(':')[0]
+    for image_host in config.IMAGE_HOSTS:
+        if hostname == image_host or (image_host.startswith('.') and hostname.endswith(image_host)):
+            return "image"
+    return "default"
+
+
+def _build_session(settings):
+    # 重试交给 ratelimit，这样每次重试也会经过限速
+    adapter = HTTPAdapter(
+        pool_connections=settings["pool_connections"],
+        pool_maxsize=settings["pool_maxsize"],
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(profile):
+    """每个连接池一个长连接 Session，线程间共享"""
+    with _sessions_lock:
+        session = _sessions.get(profile)
+        if session is None:
+            session = _build_session(config.HTTP_PROFILES[profile])
+            _sessions[profile] = session
+    return session
+
+
+def request(method, url, **kwargs):
+    """代替 requests.request，复用连接、带上默认超时，并按主机限速和退避重试"""
+    profile = profile_for(url)
+    settings = config.HTTP_PROFILES[profile]
+    kwargs.setdefault("timeout", settings["timeout"])
+    session = get_session(profile)
+    response = ratelimit.call_with_retries(url, lambda: session.request(method, url, **kwargs),
+                                           settings["retries"], settings["backoff"])
+    host = urlsplit(url).netloc
+    metrics.incr(f"http {host} {response.status_code}")
+    if not kwargs.get("stream"):
+        metrics.incr(f"bytes {host}", len(response.content))
+    return response
+
+
+def get(url, **kwargs):
+    """代替 requests.get"""
+    return request("GET", url, **kwargs)
+
+
+def head(url, **kwargs):
+    """代替 requests.head，只问地址存不存在时用"""
+    return request("HEAD", url, **kwargs)
@@ -0,0 +1,244 @@
+"""资料夹名 -> (metatube provider, 商品ID) 的本地索引，zidong 查到过的资料夹不用再调搜索接口
+
+资料夹名先规范化：去掉 CD1 / disc2 这类分盘后缀，同一作品的多个分盘资料夹共用一条记录。
+另外按元数据里的番号（FC2-PPV-XXXXXXX、ABC-123、123456-789）记一个番号键，资料夹名里
+认出同一个番号的也能查到；Vol01、EP03、BD25 这类词不当成番号。
+
+    python idindex.py import ids.csv            # 每行 资料夹名或番号,provider,商品ID
+    python idindex.py import ids.jsonl          # 每行 {"name" 或 "number", "provider", "id"}
+    python idindex.py journal                   # 从状态记录导入以前刮好的资料夹
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import config
+import metrics
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ids (
+    key TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+# 按顺序尝试，第一个匹配的就是番号
+_NUMBER_PATTERNS = [
+    (re.compile(r'FC2[-_ ]*(?:PPV[-_ ]*)?(\d{5,8})', re.IGNORECASE),
+     lambda m: f"FC2-PPV-{m.group(1)}"),
+    # 一本道、加勒比这类 日期-序号
+    (re.compile(r'(?<![A-Za-z0-9])(\d{6})[-_](\d{2,3})(?!\d)'),
+     lambda m: f"{m.group(1)}-{m.group(2)}"),
+    # 厂商代码-编号，编号去掉多余的前导零：abc00123 -> ABC-123；前后都不能连着字母数字
+    (re.compile(r'(?<![A-Za-z0-9])([A-Za-z]{2,6})[-_]?(\d{2,5})(?![A-Za-z0-9])'),
+     lambda m: None if m.group(1).upper() in _NOT_STUDIO_CODES else f"{m.group(1).upper()}-{int(m.group(2)):03d}"),
+]
+# 资料夹名里常见、形状像厂商代码的词（卷数、分盘、集数、介质、画质、音轨……），不当成番号
+_NOT_STUDIO_CODES = {
+    "VOL", "DISC", "DISK", "CD", "DVD", "BD", "BR", "EP", "PART", "PT", "NO", "NUM", "CH", "SE", "SP",
+    "OVA", "OAD", "OP", "ED", "PV", "CM", "TRACK", "TR", "PAGE", "PG", "DAY", "VER", "REV", "HD", "FHD",
+    "UHD", "SD", "HDR", "BIT", "FPS", "AAC", "AC", "DTS", "FLAC", "AVC", "HEVC", "WEB", "TS", "MP",
+}
+_DISC_SUFFIX = re.compile(r'[-_ .]*(?:cd|disc|disk)[-_ .]?\d{1,2}\s*$', re.IGNORECASE)
+_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def number_key(name):
+    """认出的番号，认不出返回 None"""
+    name = unicodedata.normalize("NFKC", name or "")
+    for pattern, build in _NUMBER_PATTERNS:
+        for match in pattern.finditer(name):
+            number = build(match)
+            if number:
+                return number
+    return None
+
+
+def name_key(name):
+    """全角转半角、忽略大小写和标点、去掉分盘后缀后的资料夹名"""
+    name = unicodedata.normalize("NFKC", name or "")
+    name = _DISC_SUFFIX.sub("", name)
+    return _SEPARATORS.sub(" ", name).strip().casefold()
+
+
+def index_keys(name):
+    """资料夹名对应的索引键，番号优先"""
+    keys = []
+    number = number_key(name)
+    if number:
+        keys.append(f"number:{number}")
+    normalized = name_key(name)
+    if normalized:
+        keys.append(f"name:{normalized}")
+    return keys
+
+
+def _import_keys(name):
+    """导入时没有元数据可以核对，只有整个名字就是番号时才写番号键"""
+    number = number_key(name)
+    if number and name_key(name) != name_key(number):
+        return [key for key in index_keys(name) if not key.startswith("number:")]
+    return index_keys(name)
+
+
+def search_query(name):
+    """发给搜索接口的关键字：去掉分盘后缀的资料夹名（认出的番号由 pick_result 用来挑结果）
+
+    资料夹名就是番号的话搜规范化后的番号
+    """
+    name = " ".join(_DISC_SUFFIX.sub("", unicodedata.normalize("NFKC", name)).split())
+    number = number_key(name)
+    if number and name_key(name) == name_key(number):
+        return number
+    return name
+
+
+class IdIndex:
+    """SQLite 保存的规范化键 -> (provider, 商品ID)，不过期，失效的由调用方 forget"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def lookup(self, name):
+        """返回 (provider, 商品ID)，没有记录返回 None"""
+        with self._lock:
+            for key in index_keys(name):
+                row = self._conn.execute("SELECT provider, item_id FROM ids WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    metrics.incr("id index hit")
+                    return row[0], row[1]
+        metrics.incr("id index miss")
+        return None
+
+    def remember(self, name, provider, item_id, number=None, source="search"):
+        """记下资料夹名（和元数据里的番号）对应的商品，返回写入的键数
+
+        番号键只用元数据里的番号写；资料夹名里认出的番号和它不一致时不写，免得误认的番号
+        把别的资料夹带到这个商品上
+        """
+        keys = [f"name:{name_key(name)}"] if name_key(name) else []
+        if number and number_key(number):
+            keys.insert(0, f"number:{number_key(number)}")
+        return self._put([(key, provider, str(item_id)) for key in dict.fromkeys(keys)], source)
+
+    def forget(self, name):
+        with self._lock:
+            self._conn.executemany("DELETE FROM ids WHERE key = ?", [(key,) for key in index_keys(name)])
+            self._conn.commit()
+
+    def import_rows(self, rows, source="import"):
+        """批量导入 (资料夹名或番号, provider, 商品ID)，返回写入的键数"""
+        entries = []
+        for name, provider, item_id in rows:
+            if name and provider and item_id:
+                entries += [(key, provider, str(item_id)) for key in _import_keys(name)]
+        return self._put(entries, source)
+
+    def _put(self, entries, source):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ids VALUES (?, ?, ?, ?, ?)",
+                [(key, provider, item_id, source, now) for key, provider, item_id in entries],
+            )
+            self._conn.commit()
+        return len(entries)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _NullIndex:
+    """关闭索引时使用，什么都不记"""
+
+    def lookup(self, name):
+        return None
+
+    def remember(self, name, provider, item_id, number=None, source="search"):
+        return 0
+
+    def forget(self, name):
+        pass
+
+    def import_rows(self, rows, source="import"):
+        return 0
+
+    def close(self):
+        pass
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """全局索引实例，第一次调用时按 config 创建"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = IdIndex(config.ID_INDEX_PATH) if config.ID_INDEX_PATH else _NullIndex()
+    return _index
+
+
+def read_rows(path):
+    """读取导入文件：.jsonl / .json 每行一个对象，其他按 CSV（可以有表头）"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if path.endswith((".jsonl", ".json")):
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    yield row.get("name") or row.get("number"), row.get("provider"), row.get("id")
+        else:
+            for row in csv.reader(f):
+                if len(row) >= 3 and row[2].strip().lower() not in ("id", "item_id"):
+                    yield row[0].strip(), row[1].strip(), row[2].strip()
+
+
+def journal_rows(path):
+    """状态记录里 metatube 查到的资料夹（gyutto 不是 metatube 的 provider，跳过）"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("provider") not in ("Gyutto", None):
+                yield os.path.basename(record["path"]), record["provider"], record["item_id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="导入 CSV 或 JSON lines 文件")
+    importer.add_argument("files", nargs="+")
+    journal = commands.add_parser("journal", help="从状态记录导入")
+    journal.add_argument("path", nargs="?", default=config.JOURNAL_PATH)
+    args = parser.parse_args()
+
+    if not config.ID_INDEX_PATH:
+        raise SystemExit("config.ID_INDEX_PATH is not set")
+    index = get_index()
+    if args.command == "import":
+        for path in args.files:
+            print(f"{path}: {index.import_rows(read_rows(path))} keys imported")
+    else:
+        print(f"{args.path}: {index.import_rows(journal_rows(args.path), source='journal')} keys imported")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
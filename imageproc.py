@@ -0,0 +1,196 @@
+"""图片后处理：下载好的封面和预览图超过 config.IMAGE_MAX_SIZE 或 IMAGE_MAX_BYTES 时缩小并重新编码
+
+需要 Pillow（pip install Pillow），没装的话这一步什么都不做。处理过的（和检查过已经够小的）图片
+按文件身份（设备、inode、大小、修改时间）和当时的限制记在 config.IMAGE_RECORD_PATH 里，
+以后再运行不用再打开，也不会对同一张图反复重新编码。资料夹改名不影响记录。
+"""
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import metrics
+from downloader import adopt_local_copy
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY,
+    limits TEXT NOT NULL,
+    status TEXT NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+# 按扩展名决定输出格式，扩展名不变，NFO 和媒体服务器找的文件名还是原来的
+_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}
+
+
+class ImageRecord:
+    """images 表：key 为文件身份，limits 为检查时的限制，status 为 within / resized / kept"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def get(self, key, limits):
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM images WHERE key = ? AND limits = ?", (key, limits)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, limits, status):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)", (key, limits, status, time.time()))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _NullRecord:
+    """不记录时使用，每次都重新检查"""
+
+    def get(self, key, limits):
+        return None
+
+    def put(self, key, limits, status):
+        pass
+
+    def close(self):
+        pass
+
+
+_record = None
+_record_lock = threading.Lock()
+_warned = False
+
+
+def get_record():
+    """全局记录实例，第一次调用时按 config 创建"""
+    global _record
+    with _record_lock:
+        if _record is None:
+            _record = ImageRecord(config.IMAGE_RECORD_PATH) if config.IMAGE_RECORD_PATH else _NullRecord()
+    return _record
+
+
+def enabled():
+    """设置了限制并且装了 Pillow"""
+    global _warned
+    if not (config.IMAGE_MAX_SIZE or config.IMAGE_MAX_BYTES):
+        return False
+    if Image is None:
+        if not _warned:
+            _warned = True
+            print("Image post-processing is configured but Pillow is not installed, skipping it")
+        return False
+    return True
+
+
+def _limits():
+    width, height = config.IMAGE_MAX_SIZE or (0, 0)
+    return f"{width}x{height}:{config.IMAGE_MAX_BYTES or 0}:q{config.IMAGE_QUALITY}"
+
+
+def _file_key(st):
+    return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def _too_large(image):
+    if not config.IMAGE_MAX_SIZE:
+        return False
+    max_width, max_height = config.IMAGE_MAX_SIZE
+    return image.width > max_width or image.height > max_height
+
+
+def _encode(image, path, fmt):
+    """缩小并按 fmt 编码到临时文件，返回临时文件路径"""
+    image = ImageOps.exif_transpose(image)
+    if config.IMAGE_MAX_SIZE:
+        image.thumbnail(config.IMAGE_MAX_SIZE, Image.LANCZOS)
+    if fmt == "JPEG":
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        options = {"quality": config.IMAGE_QUALITY, "optimize": True, "progressive": True}
+    elif fmt == "WEBP":
+        options = {"quality": config.IMAGE_QUALITY, "method": 6}
+    else:
+        options = {"optimize": True}
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        image.save(tmp_path, format=fmt, **options)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return tmp_path
+
+
+def process_image(url, path):
+    """检查一张图片，超过限制就缩小重编码（原子替换），返回 (状态, 说明)
+
+    状态为 recorded（记录里有，没打开）/ within / resized / kept（重编码后没有变小，保留原图）/ failed
+    """
+    limits = _limits()
+    record = get_record()
+    tmp_path = None
+    try:
+        st = os.stat(path)
+        if record.get(_file_key(st), limits):
+            return "recorded", ""
+        fmt = _FORMATS.get(os.path.splitext(path)[1].lower())
+        with Image.open(path) as image:
+            # 只读了文件头，尺寸够小就不用解码
+            resize = _too_large(image)
+            if not resize and (not config.IMAGE_MAX_BYTES or st.st_size <= config.IMAGE_MAX_BYTES):
+                record.put(_file_key(st), limits, "within")
+                return "within", ""
+            if fmt is None:
+                fmt = image.format
+            tmp_path = _encode(image, path, fmt)
+        new_size = os.path.getsize(tmp_path)
+        if new_size >= st.st_size and not resize:
+            os.remove(tmp_path)
+            record.put(_file_key(st), limits, "kept")
+            return "kept", ""
+        # 保留原来的修改时间，重新验证时 If-Modified-Since 还是服务器上那张图的时间
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_path, path)
+    except Exception as e:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return "failed", str(e)
+    record.put(_file_key(os.stat(path)), limits, "resized")
+    adopt_local_copy(url, path)
+    metrics.incr("image bytes saved", st.st_size - new_size)
+    return "resized", f"{st.st_size} -> {new_size} bytes"
+
+
+def process_many(tasks, max_workers=None):
+    """并行处理一批 (url, 路径)，返回与 tasks 顺序一致的 {"url", "path", "status", "message"}
+
+    Pillow 解码、缩放和编码时会释放 GIL，线程池就能用上多个核
+    """
+    max_workers = max_workers or config.IMAGE_WORKERS or os.cpu_count() or 1
+
+    def run(task):
+        url, path = task
+        status, message = process_image(url, path)
+        metrics.incr(f"image {status}")
+        return {"url": url, "path": path, "status": status, "message": message}
+
+    if not tasks:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+        return list(executor.map(run, tasks))
@@ -0,0 +1,112 @@
+import errno
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+
+import config
+import metrics
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link_or_copy(src, dst, replace=True):
+    """硬链接 src 到 dst（先链到临时名再改名，保证原子），跨磁盘或不支持硬链接时复制
+
+    临时名带进程号和线程号，几个线程同时写同一个 dst 不会互相删掉临时文件。
+    replace 为 False 时 dst 已经存在就不动它，返回 False
+    """
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.link"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        shutil.copy2(src, tmp)
+    try:
+        if replace:
+            os.replace(tmp, dst)
+        else:
+            os.link(tmp, dst)
+    except FileExistsError:
+        return False
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return True
+
+
+class ImageStore:
+    """按内容 sha256 保存图片，另外记录 URL -> 内容，下载过的 URL 不再请求"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, digest TEXT NOT NULL)")
+        self._conn.commit()
+
+    def object_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def lookup(self, url):
+        """这个 URL 之前下载过的内容在仓库里的路径，没有返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT digest FROM urls WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        path = self.object_path(row[0])
+        return path if os.path.exists(path) else None
+
+    def materialize(self, url, save_path):
+        """URL 已知时直接从仓库链接到 save_path，成功返回 True"""
+        src = self.lookup(url)
+        if src is None:
+            return False
+        try:
+            _link_or_copy(src, save_path)
+        except OSError as e:
+            print(f"Failed to link {src} to {save_path}: {e}")
+            return False
+        metrics.incr("image store hit")
+        return True
+
+    def add(self, url, save_path):
+        """刚下载好的图片入库；内容已经有了就把 save_path 换成指向已有内容的硬链接"""
+        digest = file_digest(save_path)
+        obj = self.object_path(digest)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        # 别的线程可能同时在存同样的内容，已经有了就当作命中
+        if os.path.exists(obj) or not _link_or_copy(save_path, obj, replace=False):
+            if not os.path.samefile(obj, save_path):
+                _link_or_copy(obj, save_path)
+                metrics.incr("image store dedup")
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO urls VALUES (?, ?)", (url, digest))
+            self._conn.commit()
+        return digest
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """全局图片仓库，config.IMAGE_STORE_PATH 为 None 时返回 None"""
+    global _store
+    if not config.IMAGE_STORE_PATH:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = ImageStore(config.IMAGE_STORE_PATH)
+    return _store
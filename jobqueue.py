@@ -0,0 +1,202 @@
+"""断点续跑的任务队列（SQLite）：每个资料夹一个任务，记着做到了哪一步
+
+每一步（取 ID、元数据、图片、NFO、改名）做完就把进度和 job 存下来，程序崩溃、Ctrl-C
+或者断电后重跑，没做完的资料夹从停下的那一步接着做。资料夹分批从队列里取，
+媒体库再大内存也不会涨。上一轮全部做完后再运行就是新的一轮。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+import config
+import engine
+import metrics
+import nfo
+import pipeline
+from ratelimit import RetryLater
+from scanner import scan_folder
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    folder TEXT,
+    target TEXT,
+    status TEXT NOT NULL,
+    step INTEGER NOT NULL,
+    state TEXT,
+    error TEXT,
+    updated REAL NOT NULL
+)
+"""
+_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS jobs_folder ON jobs (folder)",
+    "CREATE INDEX IF NOT EXISTS jobs_target ON jobs (target)",
+)
+_INSERT_CHUNK = 1000
+
+
+class JobQueue:
+    """jobs 表：path 为资料夹原来的路径，folder 为现在的路径，target 为要改成的路径，
+    status 为 pending / running / done / failed，step 为下一个要执行的阶段序号，
+    state 为 engine.dump_job 的 JSON
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # 断电最多丢掉最后几次进度，那几步重跑一遍，每一步都可以重复执行
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        for index in _INDEXES:
+            self._conn.execute(index)
+        self._conn.commit()
+
+    def start(self):
+        """开始一次运行，返回上次没做完的任务数；上次全部做完了就清空，开始新的一轮"""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+            unfinished = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+            if not unfinished:
+                self._conn.execute("DELETE FROM jobs")
+            self._conn.commit()
+        return unfinished
+
+    def enqueue(self, paths):
+        """加入资料夹，已经在队列里的不动（保留进度），本轮改名改出来的资料夹也不再加入
+
+        paths 可以是生成器
+        """
+        chunk = []
+        for path in paths:
+            chunk.append(path)
+            if len(chunk) >= _INSERT_CHUNK:
+                self._insert(chunk)
+                chunk = []
+        self._insert(chunk)
+
+    def _insert(self, paths):
+        if not paths:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO jobs (path, folder, status, step, updated) "
+                "SELECT ?, ?, 'pending', 0, ? WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE folder = ? OR target = ?)",
+                [(path, path, now, path, path) for path in paths],
+            )
+            self._conn.commit()
+
+    def claim(self, limit):
+        """取出最多 limit 个待做的任务，返回 [(path, step, state)]"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, path, step, state FROM jobs WHERE status = 'pending' ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+            self._conn.executemany("UPDATE jobs SET status = 'running' WHERE id = ?", [(row[0],) for row in rows])
+            self._conn.commit()
+        return [(path, step, json.loads(state) if state else None) for _, path, step, state in rows]
+
+    def save(self, path, step, state):
+        """记下做完的步骤，下次从 step 开始"""
+        folder = state["folder_path"]
+        # 改名后、记下进度前中断的话，新名字的资料夹不能当成新任务
+        target = os.path.join(os.path.dirname(folder), state["new_folder_name"]) if state.get("new_folder_name") else None
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET step = ?, state = ?, folder = ?, target = ?, updated = ? WHERE path = ?",
+                (step, json.dumps(state, ensure_ascii=False), folder, target, time.time(), path),
+            )
+            self._conn.commit()
+
+    def finish(self, path, status="done", error=None, folder=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, folder = COALESCE(?, folder), updated = ? WHERE path = ?",
+                (status, error, folder, time.time(), path),
+            )
+            self._conn.commit()
+
+    def counts(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _checkpoint(queue, index, func, last):
+    """包装一个阶段：成功后存进度，返回 None（资料夹到此为止）或者最后一步时记为完成"""
+
+    def run(item):
+        key = item.path if index == 0 else item["queue_key"]
+        try:
+            result = func(item)
+        except RetryLater:
+            raise  # 还是 running，本次运行的重跑轮次没救回来的话下次从这一步接着做
+        except Exception as e:
+            queue.finish(key, "failed", str(e))
+            raise
+        if result is None:
+            queue.finish(key)
+        elif last:
+            queue.finish(key, folder=result["folder_path"])
+        else:
+            result["queue_key"] = key
+            queue.save(key, index + 1, engine.dump_job(result))
+        return result
+
+    return run
+
+
+def _iter_paths(roots):
+    for root in roots:
+        with os.scandir(root) as it:
+            for item in it:
+                if item.is_dir():
+                    yield item.path
+
+
+def run(roots, providers, folders=None):
+    """用任务队列处理 roots 下（或者只是 folders）的资料夹"""
+    queue = JobQueue(config.JOB_QUEUE_PATH)
+    resumed = queue.start()
+    if resumed:
+        print(f"Resuming {resumed} unfinished folder(s) from {config.JOB_QUEUE_PATH}")
+    queue.enqueue(folders if folders is not None else _iter_paths(roots))
+
+    base = engine.build_stages(providers)
+    stages = [(name, _checkpoint(queue, index, func, index == len(base) - 1))
+              for index, (name, func) in enumerate(base)]
+    plugins = {p.name: p for p in providers}
+    # 暂时失败的资料夹攒到所有批次跑完后统一重跑（队列里一直是 running，不会被再认领）
+    requeue = pipeline.Requeue()
+    try:
+        while True:
+            batch = queue.claim(config.QUEUE_BATCH_SIZE)
+            if not batch:
+                break
+            by_step = defaultdict(list)
+            for path, step, state in batch:
+                if step == 0:
+                    item = scan_folder(path, with_stats=config.INCREMENTAL) if os.path.isdir(path) else None
+                else:
+                    item = engine.load_job(dict(state, queue_key=path), plugins)
+                if item is None:
+                    queue.finish(path, "failed", "folder or provider no longer exists")
+                    continue
+                by_step[step].append(item)
+            # 同一批里停在不同步骤的任务各自从那一步开始
+            for step, items in sorted(by_step.items()):
+                pipeline.run(items, stages, finish=False, requeue=requeue, start=step)
+        pipeline.retry(requeue, stages)
+    finally:
+        nfo.flush()
+        metrics.finish()
+        print(f"Job queue: {queue.counts()}")
+        queue.close()
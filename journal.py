@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import config
+from scanner import scan_folder
+
+
+def fingerprint(folder_path, files=None):
+    """资料夹内容指纹：所有文件的相对路径、大小和修改时间
+
+    files 为 scanner 收集的 [(相对路径, 大小, 修改时间ns)]，有的话就不再遍历磁盘
+    """
+    if files is None:
+        files = scan_folder(folder_path, with_stats=True).files
+    digest = hashlib.sha1()
+    for rel, size, mtime_ns in sorted(files):
+        digest.update(f"{rel}\0{size}\0{mtime_ns}\n".encode('utf-8', 'surrogateescape'))
+    return digest.hexdigest()
+
+
+_COMPACT_MIN_LINES = 1000
+
+
+class Journal:
+    """追加写入的 JSON lines 状态记录，每行一个完成的资料夹，后写的覆盖先写的"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._records = {}
+        lines = 0
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 上次中断时写了一半的行
+                    self._records[record["path"]] = record
+        self._file = open(path, 'a', encoding='utf-8')
+        # 同一个资料夹每次重刮都追加一行，过期的行超过一半时加载后重写一次，文件不会一直变大
+        if lines > _COMPACT_MIN_LINES and lines > 2 * len(self._records):
+            self.compact()
+
+    def get(self, folder_path):
+        return self._records.get(os.path.abspath(folder_path))
+
+    def is_complete(self, folder_path, files=None):
+        """上次已经刮削完成并且之后内容没变过"""
+        record = self.get(folder_path)
+        return record is not None and record["fingerprint"] == fingerprint(folder_path, files)
+
+    def record(self, folder_path, provider, item_id, files):
+        """资料夹处理完成后调用，files 为生成的文件（绝对路径或相对资料夹的路径）"""
+        folder_path = os.path.abspath(folder_path)
+        record = {
+            "path": folder_path,
+            "provider": provider,
+            "item_id": item_id,
+            "files": sorted(os.path.relpath(os.path.join(folder_path, f), folder_path) for f in files),
+            "fingerprint": fingerprint(folder_path),
+            "time": time.time(),
+        }
+        with self._lock:
+            self._records[folder_path] = record
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def compact(self):
+        """去掉重复记录和已经不存在的资料夹，重写整个文件"""
+        with self._lock:
+            self._file.close()
+            self._records = {p: r for p, r in self._records.items() if os.path.isdir(p)}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in self._records.values():
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """全局状态记录实例"""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = Journal(config.JOURNAL_PATH)
+    return _journal
@@ -0,0 +1,120 @@
+import cProfile
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+import config
+
+_lock = threading.Lock()
+_counters = Counter()
+_timings = defaultdict(list)
+_events_file = None
+_profiler = None
+
+
+def _events():
+    global _events_file
+    if _events_file is None and config.METRICS_PATH:
+        _events_file = open(config.METRICS_PATH, 'a', encoding='utf-8')
+    return _events_file
+
+
+def emit(event, **fields):
+    """写一行 JSON 事件，没配置 METRICS_PATH 时什么都不做"""
+    with _lock:
+        f = _events()
+        if f is None:
+            return
+        f.write(json.dumps({"event": event, "time": time.time(), **fields}, ensure_ascii=False) + "\n")
+
+
+def incr(name, n=1):
+    """计数器，比如 "http 200"、"cache hit Getchu"、"bytes image.gyutto.com" """
+    with _lock:
+        _counters[name] += n
+
+
+def observe(stage, seconds, **fields):
+    """记录一次阶段耗时"""
+    with _lock:
+        _timings[stage].append(seconds)
+    emit("stage", stage=stage, seconds=round(seconds, 6), **fields)
+
+
+@contextmanager
+def timed(stage, **fields):
+    """with metrics.timed("parse", item_id=...): 计时一段代码"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, **fields)
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summary():
+    """汇总表：每个阶段的次数、总耗时和 p50/p99，以及所有计数器"""
+    with _lock:
+        timings = {name: list(values) for name, values in _timings.items()}
+        counters = dict(_counters)
+    lines = [f"{'stage':<12}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p99 ms':>10}"]
+    for name, values in timings.items():
+        lines.append(f"{name:<12}{len(values):>8}{sum(values):>10.2f}"
+                     f"{_percentile(values, 50) * 1000:>10.1f}{_percentile(values, 99) * 1000:>10.1f}")
+    if counters:
+        lines.append("")
+        width = max(len(name) for name in counters)
+        for name in sorted(counters):
+            lines.append(f"{name:<{width}}  {counters[name]}")
+    return "\n".join(lines)
+
+
+def finish():
+    """运行结束：打印汇总表并关闭事件文件"""
+    global _events_file
+    if config.METRICS_SUMMARY and _timings:
+        print(summary())
+    with _lock:
+        if _events_file is not None:
+            _events_file.close()
+            _events_file = None
+    if _profiler is not None:
+        _profiler.dump_stats(config.PROFILE_PATH)
+        print(f"Profile written to {config.PROFILE_PATH}")
+
+
+def snapshot():
+    """当前的计数器和耗时，多进程模式下工作进程交给主进程合并"""
+    with _lock:
+        return {"counters": dict(_counters), "timings": {name: list(values) for name, values in _timings.items()}}
+
+
+def merge(data):
+    """合并另一个进程的 snapshot()"""
+    with _lock:
+        _counters.update(data["counters"])
+        for name, values in data["timings"].items():
+            _timings[name].extend(values)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timings.clear()
+
+
+def profiling(folder_name):
+    """这个资料夹是否需要 cProfile，是的话返回共用的 Profile 对象"""
+    global _profiler
+    if not config.PROFILE_FOLDER or folder_name != config.PROFILE_FOLDER:
+        return None
+    with _lock:
+        if _profiler is None:
+            _profiler = cProfile.Profile()
+    return _profiler
@@ -0,0 +1,82 @@
+"""多进程模式：几个媒体库根目录的资料夹分片交给进程池
+
+每个工作进程有自己的 HTTP 连接池、缓存连接和流水线，按主机的限速由 manager 进程里的
+ratelimit.RateCoordinator 统一发令牌，所有进程加起来不会超过 config.RATE_LIMITS。
+各进程的统计在结束时合并成一张汇总表。
+
+工作进程用 spawn 启动，只带过去 config 的设置和 httpclient 注册的主机；脚本里在运行时
+改掉的模块变量不会带过去，要改请直接改脚本或 config.py。
+"""
+import multiprocessing
+import os
+from functools import partial
+from itertools import chain, zip_longest
+from multiprocessing.managers import BaseManager
+
+import config
+import engine
+import httpclient
+import metrics
+import nfo
+import ratelimit
+from scanner import iter_library
+
+
+class _CoordinatorManager(BaseManager):
+    pass
+
+
+_CoordinatorManager.register("RateCoordinator", ratelimit.RateCoordinator)
+
+
+def list_folders(roots):
+    """所有根目录下的资料夹，各根目录轮流排，每个分片都能分到几个磁盘上的资料夹"""
+    per_root = []
+    for root in roots:
+        with os.scandir(root) as it:
+            per_root.append(sorted(item.path for item in it if item.is_dir()))
+    return [path for path in chain.from_iterable(zip_longest(*per_root)) if path is not None]
+
+
+def _settings():
+    return {name: getattr(config, name) for name in dir(config) if name.isupper()}
+
+
+def _init_worker(settings, hosts, coordinator):
+    for name, value in settings.items():
+        setattr(config, name, value)
+    # 汇总表由主进程合并后打印
+    config.METRICS_SUMMARY = False
+    for host, profile in hosts.items():
+        httpclient.register_host(f"//{host}", profile)
+    ratelimit.use_coordinator(coordinator)
+
+
+def _run_shard(providers, paths):
+    """工作进程里跑一个分片，返回这个分片的统计"""
+    metrics.reset()
+    entries = iter_library(None, with_stats=config.INCREMENTAL, only=paths)
+    try:
+        engine.run_stages(entries, engine.build_stages(providers))
+    finally:
+        nfo.flush()
+    return metrics.snapshot()
+
+
+def process_roots(roots, providers, folders=None, processes=None):
+    """把 roots 下的资料夹（或只是 folders）分片给 processes 个进程处理，None 为 CPU 核数"""
+    paths = list(folders) if folders is not None else list_folders(roots)
+    if not paths:
+        return
+    processes = min(processes or os.cpu_count() or 1, len(paths))
+    size = config.SHARD_SIZE
+    shards = [paths[i:i + size] for i in range(0, len(paths), size)]
+
+    context = multiprocessing.get_context("spawn")
+    with _CoordinatorManager(ctx=context) as manager:
+        coordinator = manager.RateCoordinator(config.RATE_LIMITS)
+        initargs = (_settings(), httpclient.registered_hosts(), coordinator)
+        with context.Pool(processes, initializer=_init_worker, initargs=initargs) as pool:
+            for snapshot in pool.imap_unordered(partial(_run_shard, providers), shards):
+                metrics.merge(snapshot)
+    metrics.finish()
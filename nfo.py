@@ -0,0 +1,144 @@
+"""三个脚本共用的 NFO 输出：转义后的 XML、内容没变不写、先写临时文件再改名
+
+临时文件改名前总是先 fsync（NFO 很小，代价不大），崩溃时不会把好的 movie.nfo 换成空文件。
+批量模式（config.NFO_BATCH_SIZE > 0）下改名所在的目录不马上 fsync，跨资料夹攒够 N 个目录
+（或运行结束时 flush()）再每个目录同步一次，不会调用同步整个系统的 os.sync()。资料夹要通过
+rename() 改名，攒着的目录才会跟到新路径。
+"""
+import os
+import re
+import threading
+from xml.sax.saxutils import escape
+
+import config
+import metrics
+
+# XML 1.0 不允许的控制字符，商品简介里偶尔会有
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<movie>\n'
+
+
+def xml_text(value):
+    """转义 & < > 并去掉非法字符"""
+    return escape(_INVALID_XML.sub('', str(value)))
+
+
+class Template:
+    """NFO 模板，字段顺序在创建时编译成一个格式字符串
+
+    以 * 结尾的字段（如 "genre*"）接收列表，每个值一个元素。
+    """
+
+    def __init__(self, *tags):
+        self.tags = []
+        self.repeated = set()
+        parts = [_HEADER]
+        for tag in tags:
+            if tag.endswith("*"):
+                tag = tag[:-1]
+                self.repeated.add(tag)
+                parts.append(f"{{{tag}}}")
+            else:
+                parts.append(f"    <{tag}>{{{tag}}}</{tag}>\n")
+            self.tags.append(tag)
+        parts.append("</movie>\n")
+        self._format = "".join(parts).format
+
+    def render(self, **values):
+        fields = {}
+        for tag in self.tags:
+            value = values.get(tag, "")
+            if tag in self.repeated:
+                fields[tag] = "".join(f"    <{tag}>{xml_text(v)}</{tag}>\n" for v in value or ())
+            else:
+                fields[tag] = xml_text(value)
+        return self._format(**fields)
+
+
+_pending = set()  # 有 NFO 改了名、还没同步的目录
+_pending_lock = threading.Lock()
+
+
+def _sync_dir(folder):
+    """改名要落盘还得同步所在目录（Windows 不支持也不需要）"""
+    if os.name != "posix":
+        return
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write(path, content):
+    """原子地写入 NFO，和已有文件内容一样就不动它（不改修改时间，媒体服务器不会重新扫描）
+
+    返回是否真的写了
+    """
+    data = content.encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                metrics.incr("nfo unchanged")
+                return False
+    except FileNotFoundError:
+        pass
+
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    metrics.incr("nfo written")
+
+    if config.NFO_BATCH_SIZE <= 0:
+        _sync_dir(folder)
+        return True
+    with _pending_lock:
+        _pending.add(folder)
+        full = len(_pending) >= config.NFO_BATCH_SIZE
+    if full:
+        flush()
+    return True
+
+
+def rename(old, new):
+    """改名资料夹，还没同步的目录跟着换成新路径
+
+    和 flush() 打开目录用同一把锁，不会在打开之前被改走
+    """
+    with _pending_lock:
+        os.rename(old, new)
+        for folder in [f for f in _pending if f == old or f.startswith(old + os.sep)]:
+            _pending.discard(folder)
+            _pending.add(new + folder[len(old):])
+
+
+def flush():
+    """把批量模式下还没同步的目录落盘（每个目录一次），攒满时和运行结束时调用"""
+    fds = []
+    with _pending_lock:
+        # 先打开再放锁，之后资料夹改名也不影响同步；Windows 不用同步目录
+        for folder in _pending if os.name == "posix" else ():
+            try:
+                fds.append(os.open(folder, os.O_RDONLY))
+            except OSError:
+                pass  # 已经被删掉
+        _pending.clear()
+    for fd in fds:
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
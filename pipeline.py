@@ -0,0 +1,187 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import metrics
+from ratelimit import RetryLater
+
+_DONE = object()
+
+
+class Requeue:
+    """收集暂时失败的资料夹：(失败的阶段序号, 当时的输入)"""
+
+    def __init__(self):
+        self.items = []
+        self._lock = threading.Lock()
+
+    def add(self, index, item):
+        with self._lock:
+            self.items.append((index, item))
+
+
+def _folder_name(item):
+    """阶段的输入可能是 scanner 的 FolderEntry，也可能是脚本的 job 字典"""
+    entry = item.get("entry") if isinstance(item, dict) else item
+    return getattr(entry, "name", None)
+
+
+def _run_stage(index, name, func, item, requeue):
+    """执行一个阶段，暂时失败的排队稍后重跑，其他错误打印并丢弃这个资料夹"""
+    folder = _folder_name(item)
+    profiler = metrics.profiling(folder)
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        return func(item)
+    except RetryLater as e:
+        print(f"{e} (will retry later)")
+        metrics.incr("requeued")
+        requeue.add(index, item)
+    except Exception as e:
+        print(f"Stage {name} failed for {folder or item!r}: {e}")
+        metrics.incr(f"failed {name}")
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        metrics.observe(name, time.perf_counter() - start, folder=folder)
+    return None
+
+
+def _serial(items, stages, requeue, offset=0):
+    for item in items:
+        for index, (name, func) in enumerate(stages, offset):
+            item = _run_stage(index, name, func, item, requeue)
+            if item is None:
+                break
+
+
+def _retry_rounds(requeue, stages, runner):
+    """本次运行结束前把暂时失败的资料夹从失败的阶段开始再跑几轮"""
+    for _ in range(config.REQUEUE_ROUNDS):
+        if not requeue.items:
+            return
+        pending = requeue.items
+        requeue.items = []
+        print(f"Retrying {len(pending)} folder(s) in {config.REQUEUE_DELAY}s")
+        time.sleep(config.REQUEUE_DELAY)
+        for start in sorted({index for index, _ in pending}):
+            runner([item for index, item in pending if index == start], start)
+    for _, item in requeue.items:
+        print(f"Giving up on {_folder_name(item) or item!r} after {config.REQUEUE_ROUNDS} retry round(s)")
+
+
+def _serial_runner(stages, requeue):
+    return lambda batch, start=0: _serial(batch, stages[start:], requeue, start)
+
+
+def run_serial(items, stages, requeue=None, start=0):
+    """逐个资料夹依次执行阶段（从 stages[start] 开始），阶段返回 None 表示这个资料夹到此为止
+
+    传入 requeue 时暂时失败的资料夹只收集起来，由调用方全部跑完后 retry()
+    """
+    own = requeue is None
+    requeue = Requeue() if own else requeue
+    runner = _serial_runner(stages, requeue)
+    runner(items, start)
+    if own:
+        _retry_rounds(requeue, stages, runner)
+
+
+async def _source(items, queue, loop, executor, workers):
+    iterator = iter(items)
+    while True:
+        # 目录扫描也是阻塞的，放到线程里
+        item = await loop.run_in_executor(executor, next, iterator, _DONE)
+        if item is _DONE:
+            break
+        await queue.put(item)
+    for _ in range(workers):
+        await queue.put(_DONE)
+
+
+async def _worker(index, name, func, inbox, outbox, loop, executor, requeue):
+    while True:
+        item = await inbox.get()
+        if item is _DONE:
+            return
+        result = await loop.run_in_executor(executor, _run_stage, index, name, func, item, requeue)
+        if result is not None and outbox is not None:
+            await outbox.put(result)
+
+
+async def _stage(index, name, func, workers, inbox, outbox, next_workers, loop, executor, requeue):
+    await asyncio.gather(*(_worker(index, name, func, inbox, outbox, loop, executor, requeue)
+                           for _ in range(workers)))
+    if outbox is not None:
+        for _ in range(next_workers):
+            await outbox.put(_DONE)
+
+
+async def _run(items, stages, queue_size, workers, requeue, offset=0):
+    loop = asyncio.get_running_loop()
+    counts = [workers.get(name, 1) for name, _ in stages]
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    with ThreadPoolExecutor(max_workers=sum(counts) + 1) as executor:
+        tasks = [_source(items, queues[0], loop, executor, counts[0])]
+        for i, (name, func) in enumerate(stages):
+            last = i == len(stages) - 1
+            outbox = None if last else queues[i + 1]
+            next_workers = 0 if last else counts[i + 1]
+            tasks.append(_stage(offset + i, name, func, counts[i], queues[i], outbox, next_workers,
+                                loop, executor, requeue))
+        await asyncio.gather(*tasks)
+
+
+def _pipeline_runner(stages, requeue, queue_size=None, workers=None):
+    queue_size = queue_size or config.PIPELINE_QUEUE_SIZE
+    workers = workers or config.PIPELINE_WORKERS
+
+    def runner(batch, start=0):
+        asyncio.run(_run(batch, stages[start:], queue_size, workers, requeue, start))
+
+    return runner
+
+
+def run_pipeline(items, stages, queue_size=None, workers=None, requeue=None, start=0):
+    """用 asyncio 把各阶段串成流水线，阶段之间用有界队列连接
+
+    stages 为 [(阶段名, 函数)]，每个函数接收上一阶段的结果并返回交给下一阶段的结果，
+    返回 None 表示这个资料夹到此为止。阻塞的函数在线程池里执行，
+    所以可以直接复用脚本里现有的同步函数。requeue、start 同 run_serial。
+    """
+    own = requeue is None
+    requeue = Requeue() if own else requeue
+    runner = _pipeline_runner(stages, requeue, queue_size, workers)
+    runner(items, start)
+    if own:
+        _retry_rounds(requeue, stages, runner)
+
+
+def retry(requeue, stages):
+    """分批调用 run(..., requeue=) 时，全部批次跑完后统一重跑收集到的资料夹"""
+    if config.PIPELINE_MODE:
+        runner = _pipeline_runner(stages, requeue)
+    else:
+        runner = _serial_runner(stages, requeue)
+    _retry_rounds(requeue, stages, runner)
+
+
+def run(items, stages, finish=True, requeue=None, start=0):
+    """按 config.PIPELINE_MODE 选择流水线或逐个执行，结束时输出统计
+
+    分批调用时 finish=False，全部批次跑完再由调用方 metrics.finish()；
+    传入 requeue 时暂时失败的资料夹不在这一批里重跑，由调用方最后 retry()；
+    start 为从第几个阶段开始（重跑时的阶段序号按完整的 stages 算）
+    """
+    try:
+        if config.PIPELINE_MODE:
+            run_pipeline(items, stages, requeue=requeue, start=start)
+        else:
+            run_serial(items, stages, requeue, start)
+    finally:
+        if finish:
+            metrics.finish()
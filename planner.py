@@ -0,0 +1,167 @@
+"""计划模式：只做扫描和元数据查询，把要做的下载、写 NFO、重命名写成 JSON 计划，不动任何文件
+
+config.PLAN_MODE = "plan" 时生成 config.PLAN_PATH，看过没问题再改成 "execute" 按计划执行，
+执行时用计划里保存的元数据，不再查 metatube / gyutto。重命名冲突的资料夹执行时不改名。
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+import config
+import engine
+import metrics
+import nfo
+import pipeline
+from downloader import image_tasks
+from scanner import iter_library
+
+PLAN_VERSION = 1
+
+
+def _download_actions(job):
+    entry = job["entry"]
+    revalidate = job["plugin"].overwrite_images or config.REVALIDATE_IMAGES
+    actions = []
+    for url, path in image_tasks(job["folder_path"], job["cover_url"], job["preview_images"]):
+        if path not in entry.artwork:
+            action = "download"
+        else:
+            action = "revalidate" if revalidate else "skip"
+        actions.append({"url": url, "path": path, "action": action})
+    return actions
+
+
+def _folder_plan(job):
+    folder_path = job["folder_path"]
+    nfo_paths = job["plugin"].nfo_paths(job) if job["metadata"] else []
+    rename = None
+    if job.get("new_folder_name"):
+        target = os.path.join(os.path.dirname(folder_path), job["new_folder_name"])
+        if target != folder_path:
+            # 来源记下了截断前的长度，超过 engine.NAME_LIMIT 的名字改名时被截断
+            size = job.get("name_bytes") or len(job["new_folder_name"].encode('utf-8'))
+            rename = {
+                "from": folder_path,
+                "to": target,
+                "bytes": size,
+                "truncated": size > engine.NAME_LIMIT,
+                "collision": None,
+            }
+    return {
+        "folder": folder_path,
+        "plugin": job["plugin"].name,
+        "item_id": job["item_id"],
+        "downloads": _download_actions(job),
+        "nfo": [{"path": p, "action": "update" if p in job["entry"].nfo_files else "create"} for p in nfo_paths],
+        "rename": rename,
+        "job": engine.dump_job(job),
+    }
+
+
+def _mark_collisions(folders):
+    """目标已经存在，或者几个资料夹要改成同一个名字（Windows 不分大小写，按不分大小写比较）
+
+    已经存在的目标是本次要改成别的名字的资料夹时不算冲突；那个资料夹自己冲突、不改名的话，
+    它占着的名字又算冲突，所以重复到没有新的冲突为止
+    """
+    renames = [f["rename"] for f in folders if f["rename"]]
+    targets = Counter(r["to"].casefold() for r in renames)
+    changed = True
+    while changed:
+        changed = False
+        moving = {r["from"].casefold() for r in renames
+                  if not r["collision"] and r["to"].casefold() != r["from"].casefold()}
+        for rename in renames:
+            if rename["collision"]:
+                continue
+            key = rename["to"].casefold()
+            if targets[key] > 1:
+                rename["collision"] = "duplicate target"
+            elif os.path.exists(rename["to"]) and key not in moving and key != rename["from"].casefold():
+                rename["collision"] = "target exists"
+            else:
+                continue
+            changed = True
+
+
+def _summary(folders, counters):
+    downloads = Counter(d["action"] for f in folders for d in f["downloads"])
+    renames = [f["rename"] for f in folders if f["rename"]]
+    return {
+        "folders": len(folders),
+        "by_plugin": dict(Counter(f["plugin"] for f in folders)),
+        "downloads": downloads["download"],
+        "revalidations": downloads["revalidate"],
+        "nfo_writes": sum(len(f["nfo"]) for f in folders),
+        "renames": len(renames),
+        "collisions": sum(1 for r in renames if r["collision"]),
+        "names_truncated": sum(1 for r in renames if r["truncated"]),
+        # 计划时发出的请求，结果已经进了缓存，执行时不用再请求
+        "requests_while_planning": sum(n for name, n in counters.items() if name.startswith("http ")),
+        "cache_hits": sum(n for name, n in counters.items() if name.startswith("cache hit ")),
+    }
+
+
+def plan(roots, providers, folders=None, path=None):
+    """扫描并查元数据，把计划写到 path（默认 config.PLAN_PATH），返回计划"""
+    path = path or config.PLAN_PATH
+    planned = []
+    lock = threading.Lock()
+
+    def collect(job):
+        with lock:
+            planned.append(_folder_plan(job))
+        return None
+
+    # 只要 id 和 metadata 两步，不下载、不写文件、不改名
+    stages = engine.build_stages(providers)[:2] + [("plan", collect)]
+    if folders is not None:
+        entries = iter_library(None, with_stats=config.INCREMENTAL, only=folders)
+    else:
+        entries = engine.iter_roots(roots)
+    before = metrics.snapshot()["counters"]
+    engine.run_stages(entries, stages)
+    counters = Counter(metrics.snapshot()["counters"])
+    counters.subtract(before)
+
+    planned.sort(key=lambda f: f["folder"])
+    _mark_collisions(planned)
+    result = {"version": PLAN_VERSION, "created": time.time(), "roots": roots,
+              "summary": _summary(planned, counters), "folders": planned}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+    print(f"Plan written to {path}: {json.dumps(result['summary'], ensure_ascii=False)}")
+    return result
+
+
+def execute(providers, path=None):
+    """按保存的计划下载、写 NFO、重命名"""
+    path = path or config.PLAN_PATH
+    with open(path, encoding='utf-8') as f:
+        saved = json.load(f)
+    if saved.get("version") != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version in {path}: {saved.get('version')}")
+    plugins = {p.name: p for p in providers}
+
+    def jobs():
+        for folder in saved["folders"]:
+            if folder["plugin"] not in plugins:
+                print(f"Skipping {folder['folder']}: provider {folder['plugin']} not enabled")
+                continue
+            job = engine.load_job(folder["job"], plugins)
+            if job is None:
+                print(f"Skipping {folder['folder']}: folder no longer exists")
+                continue
+            if folder["rename"] and folder["rename"]["collision"]:
+                print(f"Not renaming {folder['folder']}: {folder['rename']['collision']}")
+                job["new_folder_name"] = None
+            yield job
+
+    try:
+        pipeline.run(jobs(), engine.build_stages(providers)[2:])
+    finally:
+        nfo.flush()
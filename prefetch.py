@@ -0,0 +1,94 @@
+"""元数据批量预取：先认领一批资料夹，把要查的商品 ID / 搜索关键字去重后并发查好，再跑后面的步骤
+
+逐个资料夹处理时每个资料夹都要等一次（metatube 搜索还要等两次）元数据请求；预取后这些等待
+按批并发，同一个 ID 出现在几个资料夹（分盘、重复下载）时也只查一次。查到的结果交给各来源的
+resolve 直接使用（同时也进了缓存），暂时失败的资料夹照常排队，所有批次跑完后统一重跑。
+"""
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import config
+import metrics
+import pipeline
+from ratelimit import RetryLater
+
+
+def fetch_many(func, keys, max_workers=None):
+    """并发调用 func(key)，返回 {key: 结果}，key 先去重
+
+    暂时失败（RetryLater）的结果是那个异常，lookup 时抛出，资料夹照常排队重跑；
+    其他错误不放进结果，由 resolve 再查一次、照常报错
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+    max_workers = max_workers or config.PREFETCH_WORKERS
+
+    def run(key):
+        try:
+            return key, True, func(key)
+        except RetryLater as e:
+            return key, True, e
+        except Exception:
+            return key, False, None
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+        for key, ok, value in executor.map(run, keys):
+            if ok:
+                results[key] = value
+    metrics.incr("prefetched", len(results))
+    return results
+
+
+def lookup(prefetched, key, fetch):
+    """resolve 里取预取的结果，没有预取到就调用 fetch()
+
+    预取时暂时失败的抛出当时的 RetryLater（不再用一次完整的重试），只抛一次，
+    重跑这个资料夹时正常查询
+    """
+    if key not in prefetched:
+        return fetch()
+    value = prefetched[key]
+    if isinstance(value, RetryLater):
+        prefetched.pop(key, None)
+        raise value
+    return value
+
+
+def prefetch(jobs):
+    """按来源分组预取，返回 {(来源, 商品 ID): 元数据}"""
+    by_plugin = defaultdict(list)
+    for job in jobs:
+        by_plugin[job["plugin"]].append(job)
+    resolved = {}
+    for plugin, plugin_jobs in by_plugin.items():
+        metrics.incr("prefetch folders", len(plugin_jobs))
+        resolved.update((key, value) for key, value in plugin.prefetch(plugin_jobs).items()
+                        if not isinstance(value, RetryLater))
+    return resolved
+
+
+def run(entries, stages, finish=True):
+    """每 config.PREFETCH_BATCH_SIZE 个资料夹：认领（stages[0]）、预取元数据，再跑后面的步骤"""
+    entries = iter(entries)
+    # 暂时失败的资料夹攒到所有批次跑完后统一重跑，不是每批都等一次
+    requeue = pipeline.Requeue()
+    try:
+        while True:
+            batch = list(islice(entries, config.PREFETCH_BATCH_SIZE))
+            if not batch:
+                break
+            jobs = []
+            # 认领不会暂时失败，不用放进 requeue
+            pipeline.run_serial(batch, [stages[0], ("collect", lambda job: jobs.append(job))])
+            start = time.perf_counter()
+            prefetch(jobs)
+            metrics.observe("prefetch", time.perf_counter() - start, folders=len(jobs))
+            pipeline.run(jobs, stages, finish=False, requeue=requeue, start=1)
+        pipeline.retry(requeue, stages)
+    finally:
+        if finish:
+            metrics.finish()
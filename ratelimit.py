@@ -0,0 +1,178 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+import config
+import metrics
+
+
+class RetryLater(Exception):
+    """上游暂时不可用（超时、429、5xx），这个资料夹应该稍后重跑而不是直接放弃"""
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，最多攒 burst 个"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，没有就等"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def reserve(self):
+        """预订一个令牌，返回还要等多少秒才能用（不在锁里等，给多进程的协调者用）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, self._paused_until - now, -self._tokens / self.rate)
+
+    def pause(self, seconds):
+        """收到 429 / Retry-After 后整个主机暂停一段时间"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+def _limits_for(host, limits):
+    hostname = host.split(':')[0]
+    return limits.get(host) or limits.get(hostname) or limits["default"]
+
+
+class RateCoordinator:
+    """多进程模式下所有工作进程共用的令牌桶，跑在 multiprocessing 的 manager 进程里
+
+    工作进程每个请求前问一次要等多久，自己睡，协调者不会被某个进程的等待卡住。
+    """
+
+    def __init__(self, limits):
+        self._limits = limits
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, host):
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(*_limits_for(host, self._limits))
+                self._buckets[host] = bucket
+        return bucket
+
+    def reserve(self, host):
+        return self._bucket(host).reserve()
+
+    def pause(self, host, seconds):
+        self._bucket(host).pause(seconds)
+
+
+class _SharedBucket:
+    """工作进程里代替 TokenBucket，令牌向协调者要"""
+
+    def __init__(self, coordinator, host):
+        self._coordinator = coordinator
+        self._host = host
+
+    def acquire(self):
+        wait = self._coordinator.reserve(self._host)
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        self._coordinator.pause(self._host, seconds)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_coordinator = None
+
+
+def use_coordinator(coordinator):
+    """之后的限速都交给 RateCoordinator（的代理），多进程模式的工作进程启动时调用"""
+    global _coordinator
+    with _buckets_lock:
+        _coordinator = coordinator
+        _buckets.clear()
+
+
+def bucket_for(url):
+    """每个主机一个令牌桶，参数见 config.RATE_LIMITS"""
+    host = urlsplit(url).netloc
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            if _coordinator is not None:
+                bucket = _SharedBucket(_coordinator, host)
+            else:
+                bucket = TokenBucket(*_limits_for(host, config.RATE_LIMITS))
+            _buckets[host] = bucket
+    return bucket
+
+
+def backoff_delay(attempt, base):
+    """指数退避加全随机抖动：在 [0, base * 2^attempt] 之间随机等待"""
+    return random.uniform(0, min(config.RETRY_MAX_BACKOFF, base * (2 ** attempt)))
+
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After", "")
+    try:
+        return min(config.RETRY_MAX_BACKOFF, float(value))
+    except ValueError:
+        return None
+
+
+def call_with_retries(url, send, retries, backoff):
+    """限速后调用 send() 发请求，连接错误和 config.RETRY_STATUSES 按指数退避重试
+
+    重试用完后返回最后一次的响应，或抛出最后一次的异常
+    """
+    bucket = bucket_for(url)
+    host = urlsplit(url).netloc
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        last = attempt == retries
+        try:
+            response = send()
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.emit("http_error", url=url, attempt=attempt, error=str(e))
+            if last:
+                raise
+            metrics.incr(f"retries {host}")
+            time.sleep(backoff_delay(attempt, backoff))
+            continue
+        if response.status_code not in config.RETRY_STATUSES or last:
+            return response
+        metrics.incr(f"retries {host}")
+        wait = _retry_after(response)
+        response.close()
+        if wait is not None:
+            bucket.pause(wait)
+        else:
+            time.sleep(backoff_delay(attempt, backoff))
+
+
+def is_transient(response):
+    """重试后依然是这些状态码，说明应该晚点再试"""
+    return response.status_code in config.RETRY_STATUSES
@@ -0,0 +1,94 @@
+import os
+import time
+
+import config
+import metrics
+
+# 资料夹根目录下已有的刮削产物
+_ARTWORK_PREFIXES = ("poster", "backdrop")
+
+
+class FolderEntry:
+    """一个待刮削资料夹的索引：包含视频的子目录、已有的图片和 NFO
+
+    files 只在 with_stats=True 时收集，为 [(相对路径, 大小, 修改时间ns)]，给增量模式算指纹用
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.video_dirs = []
+        self.artwork = set()
+        self.nfo_files = []
+        self.files = None
+
+    def relocate(self, new_path):
+        """资料夹重命名后更新索引里的路径"""
+        def move(p):
+            return os.path.join(new_path, os.path.relpath(p, self.path))
+        self.video_dirs = [move(p) for p in self.video_dirs]
+        self.artwork = {move(p) for p in self.artwork}
+        self.nfo_files = [move(p) for p in self.nfo_files]
+        self.name = os.path.basename(new_path)
+        self.path = new_path
+
+    def __repr__(self):
+        return f"FolderEntry({self.path!r})"
+
+
+def _walk(entry, dir_path, rel_dir, with_stats):
+    """与 os.walk 自上而下的顺序一致，只用 scandir 自带的文件类型，不额外 stat"""
+    subdirs = []
+    has_video = False
+    try:
+        with os.scandir(dir_path) as it:
+            for item in it:
+                if item.is_dir(follow_symlinks=False):
+                    subdirs.append(item)
+                    continue
+                lower = item.name.lower()
+                if lower.endswith(config.VIDEO_EXTENSIONS):
+                    has_video = True
+                if lower == "movie.nfo":
+                    entry.nfo_files.append(item.path)
+                if not rel_dir and lower.startswith(_ARTWORK_PREFIXES):
+                    entry.artwork.add(item.path)
+                if with_stats:
+                    try:
+                        st = item.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entry.files.append((os.path.join(rel_dir, item.name), st.st_size, st.st_mtime_ns))
+    except OSError as e:
+        print(f"Failed to scan {dir_path}: {e}")
+        return
+    if has_video:
+        entry.video_dirs.append(dir_path)
+    for item in subdirs:
+        _walk(entry, item.path, os.path.join(rel_dir, item.name), with_stats)
+
+
+def scan_folder(folder_path, with_stats=False):
+    """索引单个资料夹"""
+    entry = FolderEntry(os.path.basename(folder_path), folder_path)
+    if with_stats:
+        entry.files = []
+    _walk(entry, folder_path, "", with_stats)
+    return entry
+
+
+def iter_library(base_dir, with_stats=False, only=None):
+    """逐个产出 base_dir 下每个资料夹的索引，整个目录只遍历一次
+
+    only 为资料夹路径列表时只索引这些资料夹（监视模式用）
+    """
+    if only is None:
+        with os.scandir(base_dir) as it:
+            paths = [item.path for item in it if item.is_dir()]
+    else:
+        paths = [p for p in only if os.path.isdir(p)]
+    for path in paths:
+        start = time.perf_counter()
+        entry = scan_folder(path, with_stats)
+        metrics.observe("discover", time.perf_counter() - start, folder=entry.name)
+        yield entry
@@ -0,0 +1,34 @@
+"""混合媒体库一次刮完：目录只扫描一次，每个资料夹按名字交给对应的来源
+
+[GYUTTO-XXXX] 走 gyutto.com 商品页，[GETCHU-XXXX] 走 metatube 的 Getchu 接口，
+itemXXXX 按 config.ITEM_PROVIDER，其他的用 metatube 搜索（zidong）。
+"""
+import config
+import engine
+import httpclient
+from getchu import GetchuProvider
+from gyutto import GyuttoProvider
+from watcher import watch
+from zidong import ZidongProvider
+
+
+def providers(metatube_url):
+    """按认领顺序排好的来源，metatube_url 为 metatube 的地址与端口"""
+    return [GyuttoProvider(), GetchuProvider(f"{metatube_url}/v1/movies/Getchu"), ZidongProvider(metatube_url)]
+
+
+def process_folders(base_dir, metatube_url, folders=None):
+    """folders 为资料夹路径列表时只处理这些（监视模式用）"""
+    engine.process_folders(base_dir, providers(metatube_url), folders)
+
+
+if __name__ == "__main__":
+    # 文件位置 替换成你要刮削的资料夹文件名，如果是windows要把路径的\换成\\
+    base_directory = r"C:\\Users\\用户名\\Desktop\\12345\\python"
+    # metatube，把http://10.0.0.189:123 换成你的metatube与端口
+    metatube_url = "http://10.0.0.189:123"
+    httpclient.register_host(metatube_url, "metatube")
+    process_folders(base_directory, metatube_url)
+    # 监视模式：之后放进来的新资料夹自动刮削
+    if config.WATCH_MODE:
+        watch(base_directory, lambda folders: process_folders(base_directory, metatube_url, folders))
@@ -0,0 +1,52 @@
+"""parse_item_page must give exactly the same metadata as parse_item_page_legacy on saved pages"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gyutto  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "gyutto")
+PAGES = sorted(name for name in os.listdir(FIXTURES) if name.endswith(".html"))
+
+
+def _load(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name", PAGES)
+def test_matches_legacy_parser(name):
+    html = _load(name)
+    assert gyutto.parse_item_page(html, "1") == gyutto.parse_item_page_legacy(html, "1")
+
+
+def test_normal_page():
+    metadata = gyutto.parse_item_page(_load("item123456_normal.html"), "123456")
+    assert metadata["number"] == "GYUTTO-123456"
+    assert metadata["title"] == "夏の終わりの物語"
+    assert metadata["label"] == "ひまわり工房"
+    assert metadata["tags"] == ["ノベル", "学園"]
+    assert metadata["release_date"] == "2021年08月20日"
+    assert metadata["cover_url"].endswith("/data/item_img/1234/123456/123456.jpg")
+    assert len(metadata["preview_images"]) == 3
+
+
+def test_delisted_page():
+    assert gyutto.parse_item_page(_load("item200001_delisted.html"), "200001") == {}
+
+
+def test_multi_genre_page():
+    metadata = gyutto.parse_item_page(_load("item310077_multi_genre.html"), "310077")
+    assert metadata["tags"] == ["RPG", "ファンタジー", "魔法", "ファンタジー", "ほのぼの"]
+    assert metadata["release_date"] == "2019年12月01日"
+    assert metadata["description"] == "魔法使い見習いの少女が街を救う冒険RPG。"
+
+
+def test_malformed_page():
+    metadata = gyutto.parse_item_page(_load("item400500_malformed.html"), "400500")
+    assert metadata["title"] == "閉じタグのない作品 特装版"
+    assert metadata["description"] == "Bodyinner tail"
+    assert len(metadata["preview_images"]) == 2
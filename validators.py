@@ -0,0 +1,75 @@
+"""下载过的图片的 ETag / Last-Modified / 大小，重新验证和断点续传用
+
+单独存一个 SQLite 文件，不占元数据缓存的条数，也不受 CACHE_ENABLED 影响。
+config.VALIDATORS_PATH 为 None 时只记在内存里，本次运行内的续传照样可用。
+"""
+import json
+import sqlite3
+import threading
+import time
+
+import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS validators (
+    url TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+
+class ValidatorStore:
+    """url -> {"etag", "last_modified", "size"}"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM validators WHERE url = ?", (url,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, url, validators):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO validators VALUES (?, ?, ?)",
+                               (url, json.dumps(validators), time.time()))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _MemoryStore:
+    """不保存到磁盘时使用"""
+
+    def __init__(self):
+        self._values = {}
+
+    def get(self, url):
+        value = self._values.get(url)
+        return dict(value) if value else None
+
+    def put(self, url, validators):
+        self._values[url] = dict(validators)
+
+    def close(self):
+        pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_validators():
+    """全局实例，第一次调用时按 config 创建"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ValidatorStore(config.VALIDATORS_PATH) if config.VALIDATORS_PATH else _MemoryStore()
+    return _store
@@ -0,0 +1,125 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+import config
+from journal import fingerprint, get_journal
+from scanner import scan_folder
+
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_EVENT = struct.Struct("iIII")
+
+
+class _Inotify:
+    """用 ctypes 调 Linux inotify，只监视 base_dir 这一层新建/移入的目录"""
+
+    def __init__(self, base_dir):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(base_dir), _IN_CREATE | _IN_MOVED_TO | _IN_ONLYDIR)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {base_dir}")
+        self.base_dir = base_dir
+
+    def poll(self, timeout):
+        """返回 (新目录路径列表, 是否溢出需要重新列目录)"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return [], False
+        data = os.read(self.fd, 64 * 1024)
+        paths, overflow = [], False
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                overflow = True
+            elif mask & _IN_ISDIR and name:
+                paths.append(os.path.join(self.base_dir, os.fsdecode(name)))
+        return paths, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Poller:
+    """没有 inotify 时定期列目录，对比出新出现的资料夹"""
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.known = set(self._list())
+
+    def _list(self):
+        with os.scandir(self.base_dir) as it:
+            return [item.path for item in it if item.is_dir()]
+
+    def poll(self, timeout):
+        time.sleep(timeout)
+        current = set(self._list())
+        new = current - self.known
+        self.known = current
+        return sorted(new), False
+
+    def close(self):
+        pass
+
+
+def _open_source(base_dir):
+    if sys.platform.startswith("linux"):
+        try:
+            return _Inotify(base_dir), 1
+        except OSError as e:
+            print(f"inotify unavailable ({e}), falling back to polling")
+    return _Poller(base_dir), config.WATCH_POLL_INTERVAL
+
+
+def watch(base_dir, handle):
+    """一直监视 base_dir，新资料夹内容稳定后调用 handle(资料夹路径列表)，Ctrl-C 退出
+
+    脚本自己重命名出来的资料夹已经在状态记录里，不会被重复处理。
+    """
+    source, timeout = _open_source(base_dir)
+    pending = {}  # 路径 -> (上次的内容指纹, 指纹开始不变的时间)
+    print(f"Watching {base_dir} for new folders")
+    try:
+        while True:
+            paths, overflow = source.poll(timeout)
+            if overflow:
+                # 事件太多丢了，只能重新列一次目录
+                with os.scandir(base_dir) as it:
+                    paths = [item.path for item in it if item.is_dir()]
+            journal = get_journal()
+            for path in paths:
+                if path not in pending and not journal.is_complete(path):
+                    pending[path] = (None, time.monotonic())
+
+            ready = []
+            now = time.monotonic()
+            for path, (previous, since) in list(pending.items()):
+                if not os.path.isdir(path):
+                    del pending[path]  # 又被移走或删掉了
+                    continue
+                current = fingerprint(path, scan_folder(path, with_stats=True).files)
+                if current != previous:
+                    pending[path] = (current, now)
+                elif now - since >= config.WATCH_QUIET_SECONDS:
+                    ready.append(path)
+                    del pending[path]
+            if ready:
+                handle(ready)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        source.close()